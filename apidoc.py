@@ -21,8 +21,9 @@ import sys
 import optparse
 from os import path
 
-from sphinx.util.osutil import walk
-from sphinx import __version__
+import matcher
+import walker
+from walker import walk
 
 # automodule options
 if 'SPHINX_APIDOC_OPTIONS' in os.environ:
@@ -102,7 +103,7 @@ def create_package_file(root, master_package, subroot, py_files, opts, subs):
         text += '\n'
 
     # build a list of directories that are szvpackages (contain an INITPY file)
-    subs = [sub for sub in subs if path.isfile(path.join(root, sub, INITPY))]
+    subs = [sub for sub in subs if walker.has_initpy(path.join(root, sub))]
     # if there are some package directories, add a TOC for theses subpackages
     if subs:
         text += format_heading(2, 'Subpackages')
@@ -168,7 +169,7 @@ def create_modules_toc_file(modules, opts, name='modules'):
 def shall_skip(module, opts):
     """Check if we want to skip this module."""
     # skip it if there is nothing (or just \n or \r\n) in the file
-    if path.getsize(module) <= 2:
+    if walker.getsize(module) <= 2:
         return True
     # skip if it has a "private" name and this is selected
     filename = path.basename(module)
@@ -184,7 +185,7 @@ def recurse_tree(rootpath, excludes, opts):
     ReST files.
     """
     # check if the base directory is a package and get its name
-    if INITPY in os.listdir(rootpath):
+    if INITPY in walker.listdir(rootpath)[1]:
         root_package = rootpath.split(path.sep)[-1]
     else:
         # otherwise, the base is a directory with packages
@@ -238,20 +239,13 @@ def recurse_tree(rootpath, excludes, opts):
 
 def normalize_excludes(rootpath, excludes):
     """Normalize the excluded directory list."""
-    return [path.normpath(path.abspath(exclude)) for exclude in excludes]
+    return matcher.Matcher(excludes)
 
 
 def is_excluded(root, excludes):
-    """Check if the directory is in the exclude list.
-
-    Note: by having trailing slashes, we avoid common prefix issues, like
-          e.g. an exlude "foo" also accidentally excluding "foobar".
-    """
-    root = path.normpath(root)
-    for exclude in excludes:
-        if root == exclude:
-            return True
-    return False
+    """Check if the directory is in the exclude list (or matches one of the
+    exclude patterns, see ``matcher.Matcher``)."""
+    return path.normpath(root) in excludes
 
 
 def main(argv=sys.argv):
@@ -318,7 +312,8 @@ Note: By default this script will not overwrite already created files.""")
     (opts, args) = parser.parse_args(argv[1:])
 
     if opts.show_version:
-        print('Sphinx (sphinx-apidoc) %s' %  __version__)
+        from hacked import sphinx_version  # not worth importing otherwise
+        print('Sphinx (sphinx-apidoc) %s' %  sphinx_version())
         return 0
 
     if not args:
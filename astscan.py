@@ -0,0 +1,202 @@
+from __future__ import print_function
+import ast
+
+import walker
+
+# Static (import free) inspection of packages: reads __all__ and the module
+# docstring of __init__.py, and the members of modules for --static-members,
+# by parsing them with the ast module.
+
+try:
+    string_types = basestring
+except NameError:  # Python 3
+    string_types = str
+
+# ast.Str up to Python 3.7 (removed in 3.12), ast.Constant afterwards
+STRING_NODES = tuple(getattr(ast, name) for name in ('Str', 'Constant')
+                     if hasattr(ast, name))
+
+DEFINITION_NODES = tuple(getattr(ast, name) for name in
+                         ('FunctionDef', 'AsyncFunctionDef', 'ClassDef')
+                         if hasattr(ast, name))
+# ast.TryExcept and ast.TryFinally up to Python 3.2, ast.Try afterwards
+TRY_NODES = tuple(getattr(ast, name) for name in
+                  ('Try', 'TryExcept', 'TryFinally', 'TryStar')
+                  if hasattr(ast, name))
+ANN_ASSIGN = getattr(ast, 'AnnAssign', ())  # Python 3.6+
+
+
+class DynamicAll(Exception):
+    """Raised if ``__all__`` (or ``__doc__``) is computed at import time and
+    therefore cannot be resolved without importing the package."""
+
+
+def all_attr_has_docstr(filename):
+    """Returns the same tuple as ``hacked.get_all_attr_has_docstr`` but by
+    parsing ``filename`` instead of importing it: the ``__all__`` attribute as
+    a list (``None`` if ``__all__`` is not present) and a ``bool`` indicating
+    whether the module has a docstring. Raises ``DynamicAll`` if the answer
+    depends on executing code, including syntax the ast module cannot parse
+    (Cython in ``.pyx`` files, for example).
+    """
+    tree = parse(filename)
+    return get_all_from_tree(tree), has_docstring(tree)
+
+
+def module_members(filename):
+    """The members of the module in ``filename`` that autodoc should document:
+    its ``__all__`` if present, otherwise the public names that the module
+    defines itself (functions, classes and assignments at module level, but
+    not the imported names). Raises ``DynamicAll`` like
+    ``all_attr_has_docstr``."""
+    tree = parse(filename)
+    all_attr = get_all_from_tree(tree)
+    if all_attr is not None:
+        return all_attr
+    names = []
+    for name in defined_names(tree.body):
+        if not name.startswith('_') and name not in names:
+            names.append(name)
+    return names
+
+
+def defined_names(body):
+    """The names bound at module level by the statements in ``body``, also in
+    the branches of ``if`` and ``try`` statements. A fallback in an ``except``
+    clause for a name that the ``try`` imports (``json = None`` after a
+    failed ``import json``) is still an import."""
+    names = []
+    for node in body:
+        if isinstance(node, DEFINITION_NODES):
+            names.append(node.name)
+        elif isinstance(node, ast.Assign):
+            for target in node.targets:
+                names.extend(target_names(target))
+        elif isinstance(node, ANN_ASSIGN) and node.value is not None:
+            names.extend(target_names(node.target))
+        elif isinstance(node, ast.If):
+            names.extend(defined_names(node.body) + defined_names(node.orelse))
+        elif isinstance(node, TRY_NODES):
+            for attr in ('body', 'orelse', 'finalbody'):
+                names.extend(defined_names(getattr(node, attr, [])))
+            imported = imported_names(node.body)
+            for handler in getattr(node, 'handlers', []):
+                names.extend(name for name in defined_names(handler.body)
+                             if name not in imported)
+    return names
+
+
+def imported_names(body):
+    """The names bound by the import statements of ``body``."""
+    names = set()
+    for node in body:
+        if isinstance(node, (ast.Import, ast.ImportFrom)):
+            for alias in node.names:
+                names.add((alias.asname or alias.name).split('.')[0])
+    return names
+
+
+def target_names(target):
+    if isinstance(target, ast.Name):
+        return [target.id]
+    if isinstance(target, (ast.Tuple, ast.List)):
+        return [name for elt in target.elts for name in target_names(elt)]
+    return []  # attributes and subscripts do not bind names
+
+
+def parse(filename):
+    source = walker.read(filename)  # also reads from wheels and zip files
+    try:
+        return ast.parse(source, filename)
+    except (SyntaxError, ValueError, TypeError):
+        raise DynamicAll(filename)
+
+
+def has_docstring(tree):
+    for node in tree.body:
+        if assigns_to(node, '__doc__'):
+            raise DynamicAll('__doc__ is assigned to')
+    return ast.get_docstring(tree, clean=False) is not None
+
+
+def get_all_from_tree(tree):
+    """Resolves ``__all__`` if it is only built from literal lists and tuples
+    of strings at module level: ``=``, ``+=``, ``+``, ``.append`` and
+    ``.extend`` are understood. Any other reference to ``__all__`` makes the
+    result ``DynamicAll``."""
+    all_attr = None
+    resolved = 0
+    for node in tree.body:
+        if isinstance(node, ast.Assign) and is_all_name(node.targets):
+            all_attr = literal_names(node.value)
+            resolved += 1
+        elif isinstance(node, ast.AugAssign) and is_all_name([node.target]) \
+                and isinstance(node.op, ast.Add) and all_attr is not None:
+            all_attr = all_attr + literal_names(node.value)
+            resolved += 1
+        elif is_all_method_call(node) and all_attr is not None:
+            call = node.value
+            if call.func.attr == 'append':
+                all_attr = all_attr + [literal_string(call.args[0])]
+            else:
+                all_attr = all_attr + literal_names(call.args[0])
+            resolved += 1
+    # Anything we did not understand above, e.g. __all__ assigned in an if
+    # branch, __all__ += submodule.__all__ or from x import __all__
+    if resolved != count_all_references(tree):
+        raise DynamicAll('__all__ is not a literal')
+    return all_attr
+
+
+def is_all_name(targets):
+    return len(targets) == 1 and isinstance(targets[0], ast.Name) and \
+           targets[0].id == '__all__'
+
+
+def is_all_method_call(node):
+    if not isinstance(node, ast.Expr) or not isinstance(node.value, ast.Call):
+        return False
+    call = node.value
+    return isinstance(call.func, ast.Attribute)        and \
+           call.func.attr in ('append', 'extend')      and \
+           isinstance(call.func.value, ast.Name)       and \
+           call.func.value.id == '__all__'             and \
+           len(call.args) == 1 and not call.keywords
+
+
+def literal_names(node):
+    if isinstance(node, (ast.List, ast.Tuple)):
+        return [literal_string(elt) for elt in node.elts]
+    if isinstance(node, ast.BinOp) and isinstance(node.op, ast.Add):
+        return literal_names(node.left) + literal_names(node.right)
+    raise DynamicAll('__all__ is not a literal')
+
+
+def literal_string(node):
+    if isinstance(node, STRING_NODES):
+        value = node.value if hasattr(node, 'value') else node.s
+        if isinstance(value, string_types):
+            return value
+    raise DynamicAll('__all__ has a non-string element')
+
+
+def count_all_references(tree):
+    count = 0
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Name) and node.id == '__all__':
+            count += 1
+        elif isinstance(node, ast.alias) and \
+             '__all__' in (node.name, node.asname):
+            count += 1
+        elif isinstance(node, (ast.FunctionDef, ast.ClassDef)) and \
+             node.name == '__all__':
+            count += 1
+    return count
+
+
+def assigns_to(node, name):
+    for child in ast.walk(node):
+        if isinstance(child, ast.Name) and child.id == name and \
+           not isinstance(child.ctx, ast.Load):
+            return True
+    return False
@@ -0,0 +1,148 @@
+from __future__ import print_function
+import shlex
+import sys
+import threading
+import traceback as tb
+
+try:
+    from configparser import RawConfigParser
+except ImportError:  # Python 2
+    from ConfigParser import RawConfigParser
+
+try:
+    import queue
+except ImportError:  # Python 2
+    import Queue as queue
+
+import hacked
+import pkgcache
+
+# Batch mode (--batch FILE): documents many roots in one process. The file
+# has one section per root; every section is a command line:
+#
+#   [DEFAULT]
+#   options = --respect-all --ignore-errors
+#
+#   [numpy]
+#   root    = /usr/lib/python3/dist-packages/numpy
+#   output  = build/api/numpy
+#   exclude = */tests/* *_pb2.py
+#   options = --respect-all --separate
+#
+# is "hacked.py --respect-all --separate -o build/api/numpy <root> */tests/*
+# *_pb2.py", the paths being relative to the current directory as on the
+# command line. The roots are processed --parallel-roots at a time on
+# threads that share the --respect-all cache (the --cache-file, --no-cache
+# and --clear-cache of the batch command line) and the --jobs worker
+# processes. Each root imports in its own session (see ``session``), which
+# only unloads the root's own packages, so the dependencies that several
+# roots import in this process are only loaded once. The roots take turns for
+# these in-process imports, a top level package at a time; with --jobs the
+# imports happen in the worker processes and do not wait.
+
+
+class BatchError(Exception):
+    pass
+
+
+def read_config(filename):
+    """The ``(name, argv)`` of the roots of the batch file, in file order."""
+    config = RawConfigParser()
+    if not config.read(filename):
+        raise BatchError('Cannot read the batch file %s' % filename)
+    roots = []
+    for name in config.sections():
+        def get(key):
+            return config.get(name, key) if config.has_option(name, key) \
+                   else ''
+        if not get('root'):
+            raise BatchError('No root in [%s] of %s' % (name, filename))
+        argv = shlex.split(get('options'))
+        if get('output'):
+            argv += ['-o', get('output')]
+        argv.append(get('root'))
+        argv += shlex.split(get('exclude'))
+        roots.append((name, argv))
+    if not roots:
+        raise BatchError('No roots in the batch file %s' % filename)
+    return roots
+
+
+def run_batch(filename, opts):
+    """Documents the roots of the batch file ``filename``; ``opts`` are the
+    options of the batch command line. Calls ``sys.exit`` if a root failed.
+    """
+    try:
+        roots = [prepare(name, argv) for name, argv in read_config(filename)]
+    except BatchError as e:
+        print(e, file=sys.stderr)
+        sys.exit(1)
+    share(roots, opts)
+    tasks = queue.Queue()
+    for root in roots:
+        tasks.put(root)
+    failed = []
+    threads = [ threading.Thread(target=work, args=(tasks, failed))
+                for _ in range(max(1, min(opts.parallel_roots, len(roots)))) ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if opts.cache is not None and not opts.dryrun:
+        opts.cache.save()
+    hacked.wrapped_print('%d root(s) documented, %d failed%s' %
+                         (len(roots) - len(failed), len(failed),
+                          ': %s.' % ', '.join(sorted(failed)) if failed else
+                          '.'), opts)
+    if failed:
+        sys.exit(1)
+    return 0
+
+
+def prepare(name, argv):
+    """Parses and checks the command line of a root; returns the ``(name,
+    rootpath, excludes, opts)`` to ``hacked.run``."""
+    parser = hacked.make_parser()
+    parser.prog = '%s [%s]' % (parser.get_prog_name(), name)
+    opts, args = parser.parse_args(argv)
+    if opts.batch or opts.watch or opts.archive == '-':
+        raise BatchError('[%s]: --batch, --watch and --archive - cannot be '
+                         'used in a batch' % name)
+    rootpath, excludes = hacked.check_options(parser, opts, args[0], args[1:])
+    return name, rootpath, excludes, opts
+
+
+def share(roots, opts):
+    """Gives the roots the cache and the worker slots of the batch, kept in
+    ``opts``."""
+    opts.cache = None
+    if any(o.respect_all or o.static_members for _, _, _, o in roots):
+        opts.cache = pkgcache.open_cache(opts)
+    jobs = max([opts.jobs] + [o.jobs for _, _, _, o in roots])
+    slots = threading.BoundedSemaphore(jobs)
+    for _, _, _, root_opts in roots:
+        root_opts.in_batch = True
+        root_opts.cache = opts.cache
+        root_opts.worker_slots = slots
+        root_opts.jobs = max(root_opts.jobs, opts.jobs)
+
+
+def work(tasks, failed):
+    while True:
+        try:
+            name, rootpath, excludes, opts = tasks.get_nowait()
+        except queue.Empty:
+            return
+        if run_root(name, rootpath, excludes, opts):
+            failed.append(name)
+
+
+def run_root(name, rootpath, excludes, opts):
+    """Runs ``hacked.run`` and returns its exit status."""
+    try:
+        return hacked.run(rootpath, excludes, opts) or 0
+    except SystemExit as e:  # e.g. an import error without --ignore-errors
+        return e.code if isinstance(e.code, int) else 1
+    except Exception:
+        print('[%s] %s' % (name, tb.format_exc().rstrip()), file=sys.stderr)
+        return 1
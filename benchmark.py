@@ -0,0 +1,221 @@
+from __future__ import print_function
+import json
+import optparse
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+from os.path import join
+
+import apidoc
+import hacked
+import matcher
+import walker
+
+# Generates synthetic package trees and times hacked.walk_dir_tree against
+# apidoc.recurse_tree on them, phase by phase:
+#
+#   walk   -- walking the tree and deciding what to document, nothing written
+#   import -- the same with --respect-all (hacked only)
+#   write  -- a full run writing the .rst files into an empty directory
+#
+# The results can be saved as a JSON baseline and later runs compared to it.
+
+PACKAGE = 'benchpkg'
+MODULES_PER_PACKAGE = 10
+BRANCHING = { 'wide': 50, 'deep': 2 }
+PRIVATE_EVERY = 7   # every 7th module is _private
+SYMLINK_EVERY = 25  # every 25th package gets a symlink to another package
+
+
+def make_tree(dest, modules, shape='wide', all_style='literal',
+              import_cost=0.0):
+    """Writes a package tree with about ``modules`` modules into ``dest`` and
+    returns the path of its top level package. The packages form a tree with
+    the branching factor of ``shape``; ``__all__`` is either a literal list or
+    computed (forcing --respect-all to import the package), and importing a
+    package sleeps for ``import_cost`` seconds."""
+    npackages = max(1, modules // MODULES_PER_PACKAGE)
+    branching = BRANCHING[shape]
+    paths = [join(dest, PACKAGE)]
+    for i in range(1, npackages):
+        parent = paths[(i - 1) // branching]
+        paths.append(join(parent, 'sub%d' % i))
+    for i, path in enumerate(paths):
+        os.makedirs(path)
+        names = []
+        for j in range(MODULES_PER_PACKAGE):
+            name = ('_mod%d' if j % PRIVATE_EVERY == PRIVATE_EVERY - 1
+                    else 'mod%d') % j
+            names.append(name)
+            write(join(path, name + '.py'), 'def f%d():\n    pass\n' % j)
+        write(join(path, '__init__.py'), init_source(names, all_style,
+                                                     import_cost))
+        if i % SYMLINK_EVERY == SYMLINK_EVERY - 1 and hasattr(os, 'symlink'):
+            os.symlink(paths[0], join(path, 'link%d' % i))
+    return paths[0]
+
+
+def init_source(names, all_style, import_cost):
+    lines = ['"""Package docstring."""']
+    if import_cost:
+        lines += ['import time', 'time.sleep(%r)' % import_cost]
+    public = [n for n in names if not n.startswith('_')]
+    if all_style == 'literal':
+        lines.append('__all__ = %r' % public)
+    else:
+        lines.append('__all__ = [n for n in %r]' % public)
+    return '\n'.join(lines) + '\n'
+
+
+def write(fname, text):
+    with open(fname, 'w') as f:
+        f.write(text)
+
+
+def make_opts(destdir, **kwargs):
+    opts = optparse.Values(dict(
+        destdir=destdir, maxdepth=4, force=True, update=False,
+        followlinks=False, dryrun=False, separatemodules=False,
+        includeprivate=False, notoc=False, noheadings=False,
+        modulefirst=False, suffix='rst', full=False, header=PACKAGE,
+        respect_all=False, quiet=True, ignore_errors=False, no_static=False,
+        jobs=1, write_threads=4))
+    for name, value in kwargs.items():
+        setattr(opts, name, value)
+    return opts
+
+
+def time_hacked(rootpath, destdir, phase):
+    opts = make_opts(destdir, respect_all=(phase == 'import'),
+                     dryrun=(phase != 'write'))
+    walker.forget()
+    start = time.time()
+    try:
+        if phase == 'write':
+            hacked.open_writer(opts)
+            hacked.create_modules_toc_file(
+                        hacked.walk_dir_tree(rootpath, matcher.Matcher(),
+                                             opts), opts)
+            hacked.close_writer(opts)
+        else:
+            for _ in hacked.pkgname_modules_subpkgs(rootpath,
+                                                    matcher.Matcher(), opts):
+                pass
+        return time.time() - start
+    finally:  # or the next run finds the tree already imported
+        hacked.close_import_session(opts)
+
+
+def time_apidoc(rootpath, destdir, phase):
+    opts = make_opts(destdir, dryrun=(phase != 'write'))
+    walker.forget()
+    stdout, sys.stdout = sys.stdout, open(os.devnull, 'w')  # it cannot be quiet
+    try:
+        start = time.time()
+        modules = apidoc.recurse_tree(rootpath, [], opts)
+        if phase == 'write':
+            apidoc.create_modules_toc_file(modules, opts)
+        return time.time() - start
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+
+
+TIMERS = [ ('hacked', time_hacked, ('walk', 'import', 'write')),
+           ('apidoc', time_apidoc, ('walk', 'write')) ]
+
+
+def run_case(workdir, modules, shape, all_style, import_cost, repeat):
+    treedir = join(workdir, 'tree')
+    rootpath = make_tree(treedir, modules, shape, all_style, import_cost)
+    results = {}
+    try:
+        for tool, timer, phases in TIMERS:
+            results[tool] = {}
+            for phase in phases:
+                best = None
+                for _ in range(repeat):
+                    destdir = tempfile.mkdtemp(dir=workdir)
+                    elapsed = timer(rootpath, destdir, phase)
+                    shutil.rmtree(destdir)
+                    best = elapsed if best is None else min(best, elapsed)
+                results[tool][phase] = round(best, 4)
+    finally:
+        shutil.rmtree(treedir)
+    return results
+
+
+def compare(results, baseline, tolerance, min_delta=0.01):
+    """Returns the list of timings that got slower than ``baseline`` by more
+    than ``tolerance`` (relative) and ``min_delta`` seconds."""
+    regressions = []
+    for case, tools in sorted(results.items()):
+        for tool, phases in sorted(tools.items()):
+            for phase, elapsed in sorted(phases.items()):
+                try:
+                    before = baseline[case][tool][phase]
+                except KeyError:
+                    continue
+                if elapsed > before * (1 + tolerance) and \
+                   elapsed - before > min_delta:
+                    regressions.append('%s %s %s: %.4f s -> %.4f s' %
+                                       (case, tool, phase, before, elapsed))
+    return regressions
+
+
+def main(argv=sys.argv):
+    parser = optparse.OptionParser(usage='%prog [options]')
+    parser.add_option('--sizes', default='1000,10000',
+                      help='Comma separated number of modules per tree '
+                      '(default: 1000,10000)')
+    parser.add_option('--shapes', default='wide,deep',
+                      help='wide and/or deep (default: wide,deep)')
+    parser.add_option('--all', dest='all_styles', default='literal,computed',
+                      help='How __all__ is built: literal and/or computed '
+                      '(default: both)')
+    parser.add_option('--import-cost', type='float', default=0.0,
+                      help='Seconds that each package import sleeps')
+    parser.add_option('--repeat', type='int', default=3,
+                      help='Take the best of N runs (default: 3)')
+    parser.add_option('-o', '--output', help='Save the results as JSON')
+    parser.add_option('-b', '--baseline',
+                      help='Compare with a saved JSON baseline, exit with 1 '
+                      'on regression')
+    parser.add_option('--tolerance', type='float', default=0.25,
+                      help='Allowed relative slowdown (default: 0.25)')
+    (opts, args) = parser.parse_args(argv[1:])
+
+    workdir = tempfile.mkdtemp(prefix='apidocfilter-bench-')
+    results = {}
+    try:
+        for size in [int(s) for s in opts.sizes.split(',')]:
+            for shape in opts.shapes.split(','):
+                for all_style in opts.all_styles.split(','):
+                    case = '%s-%d-%s' % (shape, size, all_style)
+                    results[case] = run_case(workdir, size, shape, all_style,
+                                             opts.import_cost, opts.repeat)
+                    print(case, json.dumps(results[case], sort_keys=True))
+    finally:
+        shutil.rmtree(workdir)
+
+    data = { 'python': sys.version.split()[0],
+             'platform': platform.platform(),
+             'results': results }
+    if opts.output:
+        with open(opts.output, 'w') as f:
+            json.dump(data, f, indent=1, sort_keys=True)
+            f.write('\n')
+    if opts.baseline:
+        with open(opts.baseline) as f:
+            baseline = json.load(f)['results']
+        regressions = compare(results, baseline, opts.tolerance)
+        for regression in regressions:
+            print('Regression:', regression, file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
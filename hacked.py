@@ -16,15 +16,21 @@
 """
 from __future__ import print_function
 
+import copy
 import os
-import string
 import sys
+import time
 import optparse
 import traceback as tb
 from os.path import join
 
-from sphinx.util.osutil import walk
-from sphinx import __version__
+import matcher
+import pkgcache
+import stats
+import templates
+import walker
+import writer
+from walker import walk
 
 # automodule options
 if 'SPHINX_APIDOC_OPTIONS' in os.environ:
@@ -38,6 +44,7 @@ else:
     ]
 
 INITPY = '__init__.py'
+INITPYX = '__init__.pyx'
 PY_SUFFIXES = set(['.py', '.pyx'])
 
 
@@ -58,113 +65,312 @@ def wrapped_print(msg, opts):
         print(msg)
 
 
+def output_file(name, opts):
+    return join(opts.destdir, '%s.%s' % (name, opts.suffix))
+
+
+def recorded_file(name, opts):
+    """The output file as the manifest records it: absolute, as the next run
+    may start from another directory."""
+    return os.path.abspath(output_file(name, opts))
+
+
 def write_file(name, text, opts):
-    """Write the output file for module/package <name>."""
-    fname = join(opts.destdir, '%s.%s' % (name, opts.suffix))
+    """Write the output file for module/package <name>, on the threads of
+    ``opts.writer`` if there is one (see ``writer``)."""
+    fname = output_file(name, opts)
+    generated = getattr(opts, 'generated', None)  # --prune and --watch
+    if generated is not None:
+        generated.add(fname)
     if opts.dryrun:
         wrapped_print('Would create file %s.' % fname, opts)
         return
-    if not opts.force and os.path.isfile(fname):
-        wrapped_print('File %s already exists, skipping.' % fname, opts)
+    with phase(opts, 'write'):
+        submit_file(fname, text, opts)
+
+
+def submit_file(fname, text, opts):
+    # In --watch mode the text of the previous pass is known, see watch.watch
+    last_written = getattr(opts, 'last_written', None)
+    if last_written is not None:
+        if last_written.get(fname) == text:
+            return
+        last_written[fname] = text
+    update = getattr(opts, 'update', False)
+    output = getattr(opts, 'writer', None)
+    if output is None:
+        log_written([writer.write(fname, text, opts.force, update)], opts)
     else:
-        wrapped_print('Creating file %s.' % fname, opts)
-        f = open(fname, 'w')
-        try:
-            f.write(text)
-        finally:
-            f.close()
+        log_written(output.submit(fname, text, opts.force, update), opts)
 
 
-def format_heading(level, text):
-    """Create a heading of <level> [1, 2 or 3 supported]."""
-    underlining = ['=', '-', '~', ][level - 1] * len(text)
-    return '%s\n%s\n\n' % (text, underlining)
+def open_writer(opts):
+    if opts.dryrun:
+        return
+    if getattr(opts, 'archive', None):
+        opts.writer = writer.ArchiveWriter(opts.archive, opts.archive_format,
+                                           opts.destdir,
+                                           getattr(opts, 'archive_stream',
+                                                   None))
+    else:
+        opts.writer = writer.Writer(getattr(opts, 'write_threads', 1))
 
 
-def format_directive(module, package=None):
-    """Create the automodule directive and add the options."""
-    directive = '.. automodule:: %s\n' % makename(package, module)
-    for option in OPTIONS:
-        directive += '    :%s:\n' % option
-    return directive
+def close_writer(opts):
+    """Waits for the pending files of ``open_writer`` to be written."""
+    output = getattr(opts, 'writer', None)
+    if output is not None:
+        opts.writer = None
+        with phase(opts, 'write'):
+            log_written(output.close(), opts)
 
 
-def create_module_file(package, module, opts):
-    """Build the text of the file and write the file."""
-    if not opts.noheadings:
-        text = format_heading(1, '%s module' % module)
-    else:
-        text = ''
-    #text += format_heading(2, ':mod:`%s` Module' % module)
-    text += format_directive(module, package)
-    write_file(makename(package, module), text, opts)
+def log_written(results, opts):
+    if not results:
+        return
+    wrapped_print('\n'.join(message for message, _, _ in results), opts)
+    for _, counter, nbytes in results:
+        count(opts, counter)
+        get_stats(opts).count('bytes_written', nbytes)
+
+
+def prune_orphans(previous, opts):
+    """Removes the files of the output directory that were generated by an
+    earlier run but not by this one (--prune), see ``plan``. ``previous``
+    are the files of the previous manifest; without one nothing is removed."""
+    import plan
+    generated = set(plan.normalize(fname) for fname in opts.generated)
+    for fname in plan.orphans(generated, opts.destdir, opts.suffix, previous):
+        if not plan.is_generated(fname, previous):
+            continue
+        if opts.dryrun:
+            wrapped_print('Would remove file %s.' % fname, opts)
+            continue
+        wrapped_print('Removing file %s.' % fname, opts)
+        os.remove(fname)
+        count(opts, 'files_removed')
 
 
-def create_package_file(master_package, subroot, submods, opts, subs):
+def report_written_files(opts):
+    if getattr(opts, 'archive', None):
+        wrapped_print('%d file(s) written to %s.' %
+                      (get_stats(opts).get('files_archived'), opts.archive),
+                      opts)
+        return
+    wrapped_print('%d file(s) created, %d updated, %d unchanged, %d skipped.' %
+                  tuple(get_stats(opts).get(counter) for counter in
+                        ('files_created', 'files_updated', 'files_unchanged',
+                         'files_skipped')), opts)
+    if getattr(opts, 'prune', False):
+        wrapped_print('%d orphaned file(s) removed.' %
+                      get_stats(opts).get('files_removed'), opts)
+
+
+def report_over_budget_packages(opts):
+    over_budget = get_stats(opts).over_budget
+    if over_budget:
+        wrapped_print('%d package(s) went over the import budget:' %
+                      len(over_budget), opts)
+        for line in stats.over_budget_lines(over_budget):
+            wrapped_print(line, opts)
+
+
+def get_templates(opts):
+    if getattr(opts, 'templates', None) is None:
+        opts.templates = templates.Templates(getattr(opts, 'templates_dir',
+                                                     None))
+    return opts.templates
+
+
+def module_members(filename, opts):
+    """The explicit members of the module or package ``__init__`` file
+    ``filename`` with --static-members (see ``astscan.module_members``),
+    ``None`` without it or if they cannot be determined statically. The
+    results are cached per file in ``opts.cache``, see ``pkgcache``."""
+    if not getattr(opts, 'static_members', False) or filename is None:
+        return None
+    cache = get_cache(opts)
+    members = cache.get_members(filename)
+    if members is not None:
+        return members
+    import astscan
+    try:
+        with phase(opts, 'parse'):
+            members = astscan.module_members(filename)
+    except (astscan.DynamicAll, IOError, OSError):
+        return None
+    cache.put_members(filename, members)
+    return members
+
+
+def package_members(path, opts):
+    """``module_members`` of the package in the directory ``path`` without
+    its submodules and subpackages, which have pages of their own; ``None``
+    (all the members) if only those were listed."""
+    members = module_members(path and init_file(path), opts)
+    if not members:
+        return members
+    dirs, files = walker.listdir(path)
+    submodules = set(dirs)
+    submodules.update(os.path.splitext(fname)[0] for fname in files
+                      if os.path.splitext(fname)[1] in PY_SUFFIXES)
+    return [name for name in members if name not in submodules] or None
+
+
+def module_file(directory, module):
+    """The file of ``module`` in ``directory``, ``None`` if not given."""
+    if directory is None:
+        return None
+    files = walker.listdir(directory)[1]
+    for suffix in ('.py', '.pyx'):
+        if module + suffix in files:
+            return join(directory, module + suffix)
+    return None
+
+
+def create_module_file(package, module, opts, path=None):
     """Build the text of the file and write the file."""
-    text = format_heading(1, '%s package' % makename(master_package, subroot))
-
-    if opts.modulefirst:
-        text += format_directive(subroot, master_package)
-        text += '\n'
-
-    # if there are some package directories, add a TOC for theses subpackages
-    if subs:
-        text += format_heading(2, 'Subpackages')
-        text += '.. toctree::\n\n'
-        for sub in subs:
-            text += '    %s.%s\n' % (makename(master_package, subroot), sub)
-        text += '\n'
-
-    if submods:
-        text += format_heading(2, 'Submodules')
-        if opts.separatemodules:
-            text += '.. toctree::\n\n'
-            for submod in submods:
-                modfile = makename(master_package, makename(subroot, submod))
-                text += '   %s\n' % modfile
-
-                # generate separate file for this module
-                if not opts.noheadings:
-                    filetext = format_heading(1, '%s module' % modfile)
-                else:
-                    filetext = ''
-                filetext += format_directive(makename(subroot, submod),
-                                             master_package)
-                write_file(modfile, filetext, opts)
-        else:
-            for submod in submods:
-                modfile = makename(master_package, makename(subroot, submod))
-                if not opts.noheadings:
-                    text += format_heading(2, '%s module' % modfile)
-                text += format_directive(makename(subroot, submod),
-                                         master_package)
-                text += '\n'
-        text += '\n'
+    docname, text = module_page(package, module, opts, path)
+    write_file(docname, text, opts)
 
-    if not opts.modulefirst:
-        text += format_heading(2, 'Module contents')
-        text += format_directive(subroot, master_package)
 
-    write_file(makename(master_package, subroot), text, opts)
+def module_page(package, module, opts, path=None):
+    """Build the ``(docname, text)`` of the page of a top level module; the
+    module is in the directory ``path``."""
+    name = makename(package, module)
+    members = module_members(module_file(path, module), opts)
+    return name, templates.render(render_module_page, name, members, opts)
+
+
+def render_module_page(write, name, members, opts):
+    tpl = get_templates(opts)
+    if not opts.noheadings:
+        tpl.heading(write, 1, '%s module' % name)
+    tpl.automodule(write, name, OPTIONS, members)
+
+
+def create_package_file(master_package, subroot, submods, opts, subs,
+                        path=None):
+    """Build the text of the file and write the file."""
+    for docname, text in package_pages(master_package, subroot, submods,
+                                       opts, subs, path):
+        write_file(docname, text, opts)
+
+
+def package_pages(master_package, subroot, submods, opts, subs, path=None):
+    """Yields the ``(docname, text)`` of the module pages of the package with
+    --separate, one by one as they are built, and then of the package page;
+    the package is in the directory ``path``."""
+    name = makename(master_package, subroot)
+    if opts.separatemodules:
+        for submod in submods:
+            modfile = makename(name, submod)
+            members = module_members(module_file(path, submod), opts)
+            yield modfile, templates.render(render_module_page, modfile,
+                                            members, opts)
+    yield name, templates.render(render_package_page, name, submods, subs,
+                                 path, opts)
+
+
+def render_package_page(write, name, submods, subs, path, opts):
+    """The sections of the package page in the order of the layout, see
+    ``templates``."""
+    tpl = get_templates(opts)
+    members = package_members(path, opts)
+    for section in tpl.layout:
+        if section == 'title':
+            tpl.heading(write, 1, '%s package' % name)
+        elif section == 'module_first' and opts.modulefirst:
+            tpl.automodule(write, name, OPTIONS, members)
+            tpl.render(write, 'blank')
+        # if there are some package directories, add a TOC for them
+        elif section == 'subpackages' and subs:
+            tpl.heading(write, 2, 'Subpackages')
+            tpl.toctree(write, ('%s.%s' % (name, sub) for sub in subs),
+                        entry='subpackage_entry')
+            tpl.render(write, 'blank')
+        elif section == 'submodules' and submods:
+            tpl.heading(write, 2, 'Submodules')
+            if opts.separatemodules:
+                tpl.toctree(write, (makename(name, submod)
+                                    for submod in submods))
+            else:
+                for submod in submods:
+                    modfile = makename(name, submod)
+                    if not opts.noheadings:
+                        tpl.heading(write, 2, '%s module' % modfile)
+                    tpl.automodule(write, modfile, OPTIONS, module_members(
+                                            module_file(path, submod), opts))
+                    tpl.render(write, 'blank')
+            tpl.render(write, 'blank')
+        elif section == 'module_last' and not opts.modulefirst:
+            tpl.heading(write, 2, 'Module contents')
+            tpl.automodule(write, name, OPTIONS, members)
 
 
 def create_modules_toc_file(modules, opts, name='modules'):
     """Create the module's index."""
-    text = format_heading(1, '%s' % opts.header)
-    text += '.. toctree::\n'
-    text += '   :maxdepth: %s\n\n' % opts.maxdepth
+    for docname, text in modules_toc_pages(modules, opts, name):
+        write_file(docname, text, opts)
+
+
+def modules_toc_pages(modules, opts, name='modules'):
+    """Yields the ``(docname, text)`` of the module's index: one page, or
+    with --toc-max-entries a tree of index pages rooted at ``name`` if the
+    index has more entries than that, see ``shards``. The pages are recorded
+    in ``opts.manifest`` if there is one."""
+    entries = list(toc_entries(modules))
+    shard_files = []
+    if not is_sharded(entries, opts):
+        yield name, templates.render(render_modules_toc, entries, opts)
+    else:
+        import shards
+        root = shards.shard(name, entries, opts.toc_max_entries)
+        for page in root.walk():
+            yield page.docname, templates.render(render_index_page, page,
+                                                 opts)
+            if page.docname != name:
+                shard_files.append(recorded_file(page.docname, opts))
+    if getattr(opts, 'manifest', None) is not None:
+        opts.manifest.data['toc'] = recorded_file(name, opts)
+        opts.manifest.data['toc_shards'] = shard_files
+
+
+def is_sharded(entries, opts):
+    max_entries = getattr(opts, 'toc_max_entries', 0)
+    return bool(max_entries) and len(entries) > max_entries
+
+
+def render_modules_toc(write, entries, opts):
+    tpl = get_templates(opts)
+    tpl.heading(write, 1, '%s' % opts.header)
+    tpl.toctree(write, entries, [('maxdepth', opts.maxdepth)])
+
+
+def render_index_page(write, page, opts):
+    """A page of a sharded modules index: the root and the inner pages list
+    the pages below them, the leaves list modules and packages."""
+    tpl = get_templates(opts)
+    if page.label is None:
+        tpl.heading(write, 1, '%s' % opts.header)
+    else:
+        tpl.heading(write, 1, '%s: %s' % (opts.header, page.label))
+    if page.children:
+        tpl.toctree(write, (child.docname for child in page.children),
+                    [('maxdepth', 1)])
+    else:
+        tpl.toctree(write, page.entries, [('maxdepth', opts.maxdepth)])
+
 
-    modules.sort()
+def toc_entries(modules):
+    """The sorted ``modules`` without the subpackages of listed packages."""
     prev_module = ''
-    for module in modules:
+    for module in sorted(modules):
         # look if the module is a subpackage and, if yes, ignore it
         if module.startswith(prev_module + '.'):
             continue
         prev_module = module
-        text += '   %s\n' % module
-
-    write_file(name, text, opts)
+        yield module
 
 
 def walk_dir_tree(rootpath, excludes, opts):
@@ -172,27 +378,315 @@ def walk_dir_tree(rootpath, excludes, opts):
     dictated by the options.
     """
     toplevels = []
+    for docname, text in iter_pages(rootpath, excludes, opts, toplevels):
+        write_file(docname, text, opts)
+    return toplevels
+
+
+def generate(rootpath, excludes=(), opts=None):
+    """Library entry point: yields the ``(docname, text)`` pairs of all the
+    pages that the command line would write, the modules index last (unless
+    ``opts.notoc``), without writing anything; ``dict(generate(...))`` maps
+    the docnames to the texts. ``opts`` defaults to ``default_options()``
+    and ``excludes`` is a ``matcher.Matcher`` or a list of exclude paths and
+    patterns. ``opts`` is not modified, so it can be reused for another root;
+    the state already in it (``stats``, ``cache``, ``manifest``) is shared.
+    """
+    opts = default_options() if opts is None else copy.copy(opts)
+    rootpath = os.path.normpath(os.path.abspath(rootpath))
+    if opts.header is None:
+        opts.header = project_name(rootpath)
+    if not isinstance(excludes, matcher.Matcher):
+        excludes = matcher.Matcher(excludes)
+    walker.forget_tree(rootpath)  # it may have changed since the last call
+    toplevels = []
+    for page in iter_pages(rootpath, excludes, opts, toplevels):
+        yield page
+    if not opts.notoc:
+        for page in modules_toc_pages(toplevels, opts):
+            yield page
+
+
+def iter_pages(rootpath, excludes, opts, toplevels):
+    """Yields the ``(docname, text)`` pairs of the module and package pages
+    in the order of the walk and appends the names that belong in the
+    modules index to ``toplevels``."""
     if has_initpy(rootpath):
         root_package = rootpath.split(os.sep)[-1]
     else:
         # Generate .rst files for the top level modules even if we are  
         # not in a package (this is a one time exception)
         root_package = None
-        mods = get_modules(os.listdir(rootpath), excludes, opts, rootpath)
+        files = walker.listdir(rootpath)[1]
+        mods = get_modules(files, excludes, opts, rootpath)
         for module in mods:
-            create_module_file(root_package, module, opts)
+            with phase(opts, 'build'):
+                page = module_page(root_package, module, opts, rootpath)
+            yield page
             toplevels.append(module)
+            if getattr(opts, 'manifest', None) is not None:
+                opts.manifest.add_module(module, recorded_file(module, opts))
+    if opts.respect_all and (getattr(opts, 'jobs', 1) > 1 or
+                             has_import_budget(opts)):
+        prefetch_imports(rootpath, excludes, opts)
     # Do the actual directory tree walk
     pkgname_mods_subpkgs = pkgname_modules_subpkgs(rootpath, excludes, opts)
-    for pkgname, mods, subpkgs in pkgname_mods_subpkgs:
-        create_package_file(root_package, pkgname, mods, opts, subpkgs)
-        toplevels.append(makename(root_package, pkgname))
+    try:
+        for pkgname, mods, subpkgs in pkgname_mods_subpkgs:
+            path = package_path(rootpath, pkgname)
+            pages = package_pages(root_package, pkgname, mods, opts, subpkgs,
+                                  path)
+            for page in timed_pages(pages, path, opts):
+                yield page
+            toplevels.append(makename(root_package, pkgname))
+            if getattr(opts, 'manifest', None) is not None:
+                add_to_manifest(rootpath, root_package, pkgname, mods,
+                                subpkgs, opts)
+    finally:
+        close_import_session(opts)
+
+
+def timed_pages(pages, path, opts):
+    """Passes on the pages of the generator ``pages``, timing their building
+    as the 'build' phase and as time spent on the package ``path``."""
+    stats = get_stats(opts)
+    while True:
+        start = time.time()
+        with stats.phase('build'):
+            page = next(pages, None)
+        stats.add_package_time(path, time.time() - start)
+        if page is None:
+            return
+        yield page
+
+
+def add_to_manifest(rootpath, master_package, pkgname, mods, subpkgs, opts):
+    """Records a package page in ``opts.manifest``, see ``manifest``."""
+    opts.manifest.data['root_package'] = master_package
+    opts.manifest.data['packages'].append(
+        manifest_entry(rootpath, master_package, pkgname, mods, subpkgs, opts))
+
+
+def manifest_entry(rootpath, master_package, pkgname, mods, subpkgs, opts):
+    import manifest
+    path = package_path(rootpath, pkgname)
+    name = makename(master_package, pkgname)
+    module_files = []
+    if opts.separatemodules:
+        module_files = [recorded_file(makename(name, mod), opts)
+                        for mod in mods]
+    all_attr = all_source = has_docstr = None
+    if opts.respect_all:
+        all_attr, has_docstr = get_all_attr_has_docstr(rootpath, path, opts)
+        all_source = get_cache(opts).source(init_file(path))
+    return manifest.package_entry(name, path, mods, subpkgs,
+                                  recorded_file(name, opts), module_files,
+                                  all_attr, all_source, has_docstr)
+
+
+def package_path(rootpath, pkgname):
+    return join(rootpath, *pkgname.split('.')) if pkgname else rootpath
+
+
+def regenerate(rootpath, excludes, opts):
+    """One pass of --watch mode: the package files and the modules index."""
+    open_writer(opts)
+    open_manifest(rootpath, excludes, opts)
+    with phase(opts, 'walk'):
+        modules = walk_dir_tree(rootpath, excludes, opts)
+    if not opts.notoc:
+        with phase(opts, 'build'):
+            create_modules_toc_file(modules, opts)
+    close_writer(opts)
+    save_manifest(opts)
+    save_cache(opts)
+
+
+def update_since(rootpath, excludes, opts, previous, changed):
+    """--since: regenerates the pages of the packages affected by the
+    ``changed`` paths (see ``since``) and takes the others over from the
+    previous run, ``previous`` being its manifest. The top level modules are
+    listed again, and the modules index is only rebuilt if its entries
+    changed."""
+    import since
+    changed = [path for path in changed
+               if os.path.splitext(path)[1] in PY_SUFFIXES]
+    root_package = rootpath.split(os.sep)[-1] if has_initpy(rootpath) else None
+    modules = since_modules(rootpath, excludes, opts, previous, changed)
+    records = dict((since.package_name(rootpath, pkg['path']), pkg)
+                   for pkg in previous['packages'])
+    queue = since.affected_packages(rootpath, changed)
+    if root_package is None:
+        queue.discard('')  # the top level modules, see since_modules
+    if opts.respect_all and (getattr(opts, 'jobs', 1) > 1 or
+                             has_import_budget(opts)):
+        prefetch_imports(rootpath, excludes, opts,
+                         since_import_candidates(rootpath, queue))
+    try:
+        while queue:
+            pkgname = min(queue, key=lambda name: (name.count('.'), name))
+            queue.discard(pkgname)  # parents first
+            contents = None
+            if is_listed(pkgname, records, root_package):
+                contents = package_dir_contents(rootpath, pkgname, excludes,
+                                                opts)
+            if contents is None:
+                drop_packages(pkgname, records)
+                continue
+            subpkgs = contents[2]
+            old = records.get(pkgname)
+            for sub in (old['subpackages'] if old else ()):
+                if sub not in subpkgs:
+                    drop_packages(makename(pkgname, sub), records)
+            queue.update(makename(pkgname, sub) for sub in subpkgs
+                         if makename(pkgname, sub) not in records)
+            records[pkgname] = rebuild_package(rootpath, root_package,
+                                               contents, opts)
+    finally:
+        close_import_session(opts)
+    data = opts.manifest.data
+    data['root_package'] = root_package
+    data['modules'] = [modules[name] for name in sorted(modules)]
+    data['packages'] = sorted(records.values(),
+                              key=lambda pkg: pkg['name'].split('.'))
+    toplevels = sorted(modules) + [pkg['name'] for pkg in data['packages']]
+    old_toplevels = [m['name'] for m in previous['modules']] + \
+                    [pkg['name'] for pkg in previous['packages']]
+    if opts.notoc:
+        return
+    if list(toc_entries(toplevels)) != list(toc_entries(old_toplevels)) or \
+       not previous['toc'] or not os.path.isfile(previous['toc']):
+        with phase(opts, 'build'):
+            create_modules_toc_file(toplevels, opts)
+    else:
+        data['toc'] = previous['toc']
+        data['toc_shards'] = previous.get('toc_shards', [])
 
-    return toplevels
+
+def since_modules(rootpath, excludes, opts, previous, changed):
+    """The top level modules (name -> manifest entry) for --since; the pages
+    of the new and changed ones are rebuilt."""
+    if has_initpy(rootpath):
+        return {}
+    old = dict((m['name'], m) for m in previous['modules'])
+    changed = set(os.path.splitext(os.path.basename(path))[0]
+                  for path in changed if os.path.dirname(path) == rootpath)
+    modules = {}
+    files = walker.listdir(rootpath)[1]
+    for module in get_modules(files, excludes, opts, rootpath):
+        if module in old and module not in changed:
+            modules[module] = old[module]
+            continue
+        with phase(opts, 'build'):
+            docname, text = module_page(None, module, opts, rootpath)
+        write_file(docname, text, opts)
+        modules[module] = { 'name': module,
+                            'file': recorded_file(module, opts) }
+    return modules
+
+
+def since_import_candidates(rootpath, pkgnames):
+    """The package directories that --since may import: the affected
+    packages and their subpackages."""
+    paths = []
+    for pkgname in sorted(pkgnames):
+        path = package_path(rootpath, pkgname)
+        if has_initpy(path):
+            paths.append(path)
+            paths.extend(join(path, d) for d in sorted(walker.listdir(path)[0])
+                         if has_initpy(join(path, d)))
+    return paths
+
+
+def is_listed(pkgname, records, root_package):
+    """Whether the parent of the package lists it (--since); every directory
+    is looked at below a root that is not a package."""
+    parent, _, name = pkgname.rpartition('.')
+    if not pkgname or (not parent and root_package is None):
+        return True
+    return parent in records and name in records[parent]['subpackages']
+
+
+def package_dir_contents(rootpath, pkgname, excludes, opts):
+    """``package_contents`` of the package directory of ``pkgname``."""
+    root = package_path(rootpath, pkgname)
+    if not os.path.isdir(root):
+        return None
+    count(opts, 'dirs_visited')
+    dirs, files = walker.listdir(root)
+    return package_contents(rootpath, root, sorted(dirs), files, excludes,
+                            opts)[0]
+
+
+def drop_packages(pkgname, records):
+    """Forgets the package and its subpackages (--since)."""
+    for name in list(records):
+        if name == pkgname or name.startswith(pkgname + '.'):
+            del records[name]
+
+
+def rebuild_package(rootpath, root_package, contents, opts):
+    """Writes the pages of a package and returns its manifest entry."""
+    pkgname, mods, subpkgs = contents
+    path = package_path(rootpath, pkgname)
+    count(opts, 'packages_rebuilt')
+    pages = package_pages(root_package, pkgname, mods, opts, subpkgs, path)
+    for docname, text in timed_pages(pages, path, opts):
+        write_file(docname, text, opts)
+    return manifest_entry(rootpath, root_package, pkgname, mods, subpkgs, opts)
+
+
+def since_manifest(rootpath, excludes, opts):
+    """The manifest of the previous run for --since, or ``None`` (with a
+    message) if there is none that --since can build on: another tree or
+    output directory, or options that change the pages."""
+    import manifest
+    data = manifest.load(opts.manifest_file)
+    if data is None or data['root'] != rootpath or \
+       data['destdir'] != os.path.abspath(opts.destdir) or \
+       data['suffix'] != opts.suffix:
+        wrapped_print('No manifest of a previous run of %s in %s, '
+                      'regenerating everything.' % (rootpath,
+                                                    opts.manifest_file), opts)
+        return None
+    if data.get('options') != page_options(excludes, opts):
+        wrapped_print('The options changed since the run of %s, '
+                      'regenerating everything.' % opts.manifest_file, opts)
+        return None
+    return data
+
+
+# The options that change the pages, recorded in the manifest for --since
+PAGE_OPTIONS = ('respect_all', 'includeprivate', 'separatemodules',
+                'modulefirst', 'noheadings', 'notoc', 'maxdepth', 'header',
+                'followlinks', 'ignore_errors', 'no_static', 'static_members',
+                'import_timeout', 'import_memory', 'toc_max_entries')
+
+
+def page_options(excludes, opts):
+    """The ``PAGE_OPTIONS``, the templates and the ``excludes`` (a
+    ``matcher.Matcher``) of the run."""
+    options = dict((name, getattr(opts, name, None))
+                   for name in PAGE_OPTIONS)
+    options['templates'] = get_templates(opts).digest()
+    options['excludes'] = excludes.describe()
+    return options
+
+
+def open_manifest(rootpath, excludes, opts):
+    if getattr(opts, 'manifest_file', None):
+        import manifest
+        opts.manifest = manifest.Manifest(rootpath, opts.destdir, opts.suffix,
+                                          page_options(excludes, opts))
+
+
+def save_manifest(opts):
+    if getattr(opts, 'manifest', None) is not None and not opts.dryrun:
+        opts.manifest.save(opts.manifest_file)
 
 
 def has_initpy(directory):
-    return os.path.isfile( join(directory, INITPY) )
+    return walker.has_initpy(directory)
 
 
 def pkgname_modules_subpkgs(rootpath, excluded, opts):
@@ -200,29 +694,40 @@ def pkgname_modules_subpkgs(rootpath, excluded, opts):
     yields tuples of (package name, modules, subpackages).  
     """
     for root, dirs, files in walk(rootpath, followlinks=opts.followlinks):
-        if root in excluded:
-            del dirs[:] # skip all subdirectories as well
-            continue
-        if INITPY not in files:
-            if root != rootpath:
-                del dirs[:]
-            continue
-        pkg_name = root[len(rootpath):].lstrip(os.sep).replace(os.sep, '.')
-        if not opts.includeprivate and pkg_name.startswith('_'):
-            del dirs[:]
-            continue
-        modules = get_modules(files, excluded, opts, root)
-        subpkgs = get_subpkgs(dirs,  excluded, opts, root, rootpath)
-        dirs[:] = subpkgs # visit only subpackages
-        has_sg_to_doc = True 
-        if opts.respect_all:
-            all_attr, has_docstr = get_all_attr_has_docstr(rootpath, root, opts)
-            has_sg_to_doc = has_docstr or bool(all_attr)
-            # has_sg_to_doc: e.g. multiprocessing.dummy has nonempty __all__ but 
-            # no modules, subpkgs or docstring to document -> still document it!                   
-            modules = get_only_modules(all_attr, modules)
-        if modules or subpkgs or has_sg_to_doc:
-                yield pkg_name, modules, subpkgs
+        count(opts, 'dirs_visited')
+        get_stats(opts).count('files_seen', len(files))
+        contents, subdirs = package_contents(rootpath, root, dirs, files,
+                                             excluded, opts)
+        dirs[:] = subdirs
+        if contents is not None:
+            yield contents
+
+
+def package_contents(rootpath, root, dirs, files, excluded, opts):
+    """Decides about the directory ``root`` with the subdirectories ``dirs``
+    and the ``files``: returns the tuple (package name, modules,
+    subpackages) to document or ``None``, and the subdirectories to visit.
+    """
+    if root in excluded:
+        return None, [] # skip all subdirectories as well
+    if INITPY not in files:
+        return None, (dirs if root == rootpath else [])
+    pkg_name = root[len(rootpath):].lstrip(os.sep).replace(os.sep, '.')
+    if not opts.includeprivate and pkg_name.startswith('_'):
+        return None, []
+    modules = get_modules(files, excluded, opts, root)
+    subpkgs = get_subpkgs(dirs,  excluded, opts, root, rootpath)
+    # visit only subpackages
+    has_sg_to_doc = True 
+    if opts.respect_all:
+        all_attr, has_docstr = get_all_attr_has_docstr(rootpath, root, opts)
+        has_sg_to_doc = has_docstr or bool(all_attr)
+        # has_sg_to_doc: e.g. multiprocessing.dummy has nonempty __all__ but 
+        # no modules, subpkgs or docstring to document -> still document it!                   
+        modules = get_only_modules(all_attr, modules)
+    if modules or subpkgs or has_sg_to_doc:
+        return (pkg_name, modules, subpkgs), subpkgs
+    return None, subpkgs
 
 
 def get_modules(files, excluded, opts, root):
@@ -261,45 +766,229 @@ def get_only_modules(all_attr, modules):
     return [m for m in all_attr if m in mods]
 
 
-def get_all_attr_has_docstr(rootpath, path, opts, cached={}):
+def get_all_attr_has_docstr(rootpath, path, opts):
     """Returns a tuple: the ``__all__`` attribute of the package as a list 
     (``None`` if ``__all__`` is not  present) and a ``bool`` indicating whether
-    the module has a doc string. Calls ``sys.exit`` on failure 
-    (e.g. ``ImportError``), unless the --ignore-errors flag is used. Returns 
-    ``(None, False)`` on ignored error. A simple-minded caching is used as we 
-    look at each package twice.
+    the module has a doc string. The ``__init__`` file is parsed first, the
+    package is only imported if that is not enough, see ``astscan``. Calls 
+    ``sys.exit`` on failure (e.g. ``ImportError``), unless the --ignore-errors
+    flag is used. Returns ``(None, False)`` on ignored error. The results are
+    cached in ``opts.cache``, see ``pkgcache``; we look at each package twice.
     """
-    if path in cached:
-        return cached[path]
-    
+    result = lookup_without_import(path, opts)
+    if result is not None:
+        return result
+    count(opts, 'packages_imported')
+    start = time.time()
+    with phase(opts, 'import'):
+        if path in getattr(opts, 'imported', {}):
+            result = prefetched_all_attr_has_docstr(rootpath, path, opts)
+        else:
+            result = import_all_attr_has_docstr(rootpath, path, opts)
+    get_stats(opts).add_package_time(path, time.time() - start)
+    initfile = init_file(path)
+    if result is None:  # ignored error, remembered for this run only
+        result = (None, False)
+        get_cache(opts).put(initfile, result)
+    else:
+        get_cache(opts).put(initfile, result, 'import')
+    return result
+
+
+def lookup_without_import(path, opts):
+    """The cached or statically computed result of ``get_all_attr_has_docstr``
+    or ``None`` if the package has to be imported."""
+    cache = get_cache(opts)
+    initfile = init_file(path)
+    no_static = getattr(opts, 'no_static', False)
+    result = cache.get(initfile, ('import',) if no_static else
+                                 ('static', 'import'))
+    if result is not None or no_static:
+        return result
+    import astscan  # only needed with --respect-all
+    try:
+        with phase(opts, 'parse'):
+            result = astscan.all_attr_has_docstr(initfile)
+    except astscan.DynamicAll:
+        return None
+    cache.put(initfile, result, 'static')
+    return result
+
+
+def get_cache(opts):
+    if getattr(opts, 'cache', None) is None:
+        opts.cache = pkgcache.Cache()
+    return opts.cache
+
+
+def save_cache(opts):
+    if getattr(opts, 'in_batch', False):  # shared, saved by batch.run_batch
+        return
+    if getattr(opts, 'cache', None) is not None and not opts.dryrun:
+        opts.cache.save()
+
+
+def import_all_attr_has_docstr(rootpath, path, opts):
+    """Imports the package to get its ``__all__`` and docstring, see
+    ``get_all_attr_has_docstr``. Returns ``None`` on ignored error. The
+    import happens in the session of its top level package, see
+    ``session``; the imported modules are removed from ``sys.modules`` when
+    the walk leaves it, unless ``opts.keep_modules`` is set (see
+    ``sphinxext``)."""
+    head, pkg = find_top_package(rootpath, path)
+    session = get_import_session(opts)
     try:
-        path_before = list(sys.path)
-        modules_before = set(sys.modules)
-        head, pkg = find_top_package(rootpath, path)
-        sys.path.append(head)  # Prepend or append?
-        __import__(pkg)  # for Python 2.6 compatibility
-        module = sys.modules[pkg]
-        all_attrib = get_all_from(module)
-        # cairo and zope has __doc__ but it is None
-        has_docstring = getattr(module, '__doc__', None) is not None
-        cached[path] = (all_attrib, has_docstring)
-        return cached[path]
-    except AssertionError:
-        raise    
+        with session.lock:  # --batch imports from several threads
+            session.enter(head, pkg)  # a new session is not part of the cost
+            module = profiled(path, pkg, opts, session.load, head, pkg)
+            return all_attr_has_docstr(module)
     except:
-        print('\n', tb.format_exc().rstrip(), file=sys.stderr)         
-        print('Please make sure that the package \'%s\' can be imported (or use'
-              ' --ignore-errors\nor exclude %s).' % (pkg,path), file=sys.stderr)
-        if not opts.ignore_errors:
-            sys.exit(1)
-    finally:
-        difference = sys.modules.viewkeys() - modules_before        
-        for k in difference:
-            sys.modules.pop(k)
-        sys.path = path_before
+        report_import_error(pkg, path, tb.format_exc().rstrip(), opts)
     # We only get here if there was an ignored error, for example on ImportError
-    cached[path] = (None, False) 
-    return cached[path] 
+    return None
+
+
+def profiled(path, pkg, opts, load, *args):
+    """Calls ``load(*args)``, the import of ``pkg``; with --profile-imports
+    its cost is recorded in ``opts.profiler``, see ``profiler``."""
+    if getattr(opts, 'profiler', None) is None:
+        return load(*args)
+    import profiler
+    value, record = profiler.measure(load, *args)
+    opts.profiler.add(path, pkg, record)
+    return value
+
+
+def get_import_session(opts):
+    if getattr(opts, 'import_session', None) is None:
+        import session  # only needed with --respect-all
+        opts.import_session = session.ImportSession(
+                                        getattr(opts, 'keep_modules', False))
+    return opts.import_session
+
+
+def close_import_session(opts):
+    if getattr(opts, 'import_session', None) is not None:
+        opts.import_session.close()
+
+
+def import_package(head, pkg):
+    """Imports ``pkg`` from ``head`` and returns its ``__all__`` and whether it
+    has a docstring. Leaves ``sys.path`` and ``sys.modules`` modified."""
+    sys.path.append(head)  # Prepend or append?
+    __import__(pkg)  # for Python 2.6 compatibility
+    return all_attr_has_docstr(sys.modules[pkg])
+
+
+def profile_import_package(head, pkg):
+    """``import_package`` and the record of its cost, for --profile-imports
+    in a worker process."""
+    import profiler
+    return profiler.measure(import_package, head, pkg)
+
+
+def all_attr_has_docstr(module):
+    # cairo and zope has __doc__ but it is None
+    return get_all_from(module), getattr(module, '__doc__', None) is not None
+
+
+def report_import_error(pkg, path, trace, opts):
+    print('\n', trace, file=sys.stderr)
+    print('Please make sure that the package \'%s\' can be imported (or use'
+          ' --ignore-errors\nor exclude %s).' % (pkg,path), file=sys.stderr)
+    if not opts.ignore_errors:
+        sys.exit(1)
+
+
+def has_import_budget(opts):
+    return bool(getattr(opts, 'import_timeout', None) or
+                getattr(opts, 'import_memory', None))
+
+
+def prefetch_imports(rootpath, excluded, opts, paths=None):
+    """Imports the packages that --respect-all cannot resolve statically in
+    ``opts.jobs`` parallel processes, each package in a fresh process (see
+    ``workers``). The outcomes are kept in ``opts.imported`` and consumed by
+    ``get_all_attr_has_docstr`` in the order of the serial walk, so errors are
+    only reported for packages that the walk actually reaches. An import can
+    only be aborted in a process of its own, so this is also how the
+    --import-timeout and --import-memory budgets are enforced. Only the
+    package directories ``paths`` are considered if given (--since).
+    """
+    if paths is None:
+        paths = candidate_packages(rootpath, excluded, opts)
+    tasks = [ (path, find_top_package(rootpath, path)) for path in paths
+              if lookup_without_import(path, opts) is None ]
+    import workers  # multiprocessing is slow to import
+    with phase(opts, 'import'):
+        target = import_package
+        if getattr(opts, 'profiler', None) is not None:
+            target = profile_import_package
+        opts.imported = workers.run(target, tasks,
+                                    getattr(opts, 'jobs', 1),
+                                    getattr(opts, 'import_timeout', None),
+                                    getattr(opts, 'import_memory', None),
+                                    getattr(opts, 'worker_slots', None))
+
+
+def report_over_budget(path, reason_seconds, opts):
+    """An import that went over the budget is skipped, as an error is with
+    --ignore-errors, and listed at the end of the run."""
+    reason, seconds = reason_seconds
+    print('Skipped the import of %s: %s.' % (path, reason), file=sys.stderr)
+    get_stats(opts).add_over_budget(path, reason, seconds)
+
+
+def prefetched_all_attr_has_docstr(rootpath, path, opts):
+    """Same as ``import_all_attr_has_docstr`` but takes the outcome of the
+    import from ``prefetch_imports``."""
+    outcome, value = opts.imported.pop(path)
+    if outcome == 'ok' and getattr(opts, 'profiler', None) is not None:
+        value, record = value
+        opts.profiler.add(path, find_top_package(rootpath, path)[1], record)
+    if outcome == 'ok':
+        return value
+    if outcome == 'budget':
+        report_over_budget(path, value, opts)
+        return None
+    report_import_error(find_top_package(rootpath, path)[1], path, value, opts)
+    return None
+
+
+def candidate_packages(rootpath, excluded, opts):
+    """Yields the package directories that ``pkgname_modules_subpkgs`` may
+    visit, a superset as ``__all__`` is not considered here."""
+    exclude_prefixes = ('.',) if opts.includeprivate else ('.', '_')
+    for root, dirs, files in walk(rootpath, followlinks=opts.followlinks):
+        if INITPY in files:
+            yield root
+        elif root != rootpath:
+            del dirs[:]
+            continue
+        dirs[:] = [ d for d in dirs if not d.startswith(exclude_prefixes) and
+                                       norm_path(root, d) not in excluded ]
+
+
+def init_file(path):
+    """The ``__init__`` file that Python would import: a compiled Cython
+    ``__init__.pyx`` takes precedence over ``__init__.py``."""
+    pyx = join(path, INITPYX)
+    return pyx if INITPYX in walker.listdir(path)[1] else join(path, INITPY)
+
+
+def count(opts, counter):
+    get_stats(opts).count(counter)
+
+
+def get_stats(opts):
+    if getattr(opts, 'stats', None) is None:
+        opts.stats = stats.Stats()
+    return opts.stats
+
+
+def phase(opts, name):
+    """Context manager timing a phase of the run, see ``stats.Stats``."""
+    return get_stats(opts).phase(name)
 
 
 def find_top_package(root, path):
@@ -317,7 +1006,7 @@ def find_top_package(root, path):
     while roothead != head and has_initpy(head): 
         head, pkg = os.path.split(head)
         tail = join(pkg, tail)
-    return head, string.replace(tail, os.sep, '.')
+    return head, tail.replace(os.sep, '.')
 
 
 def get_all_from(module):
@@ -333,17 +1022,48 @@ def norm_path(root, mod_or_dir):
     return os.path.normpath( join(root, mod_or_dir) )
 
 
-def main(argv=sys.argv):
-    """Parse and check the command line arguments."""
+def sphinx_version():
+    """Sphinx itself is only needed for --full, so it is imported lazily."""
+    try:
+        from sphinx import __version__
+    except ImportError:
+        return '(Sphinx is not installed)'
+    return __version__
+
+
+def default_options(**kwargs):
+    """The command line options with their default values, overridden by
+    ``kwargs`` (e.g. ``respect_all=True``), for ``generate``."""
+    opts = make_parser().get_default_values()
+    for name, value in kwargs.items():
+        setattr(opts, name, value)
+    return opts
+
+
+def project_name(rootpath):
+    """The default --doc-project: the name of the directory, or the name of
+    the distribution of a wheel or an egg (foo of foo-1.0-py3-none-any.whl)."""
+    name = os.path.normpath(rootpath).split(os.sep)[-1]
+    if walker.is_archive(rootpath):
+        name = os.path.splitext(name)[0].split('-')[0]
+    return name
+
+
+def make_parser():
     parser = optparse.OptionParser(
         usage="""\
 usage: %prog [options] -o <output_path> <module_path> [exclude_path, ...]
 
 Look recursively in <module_path> for Python modules and packages and create
 one reST file with automodule directives per package in the <output_path>.
+The <module_path> can also be a wheel, an egg or a zip file: its modules are
+read from the archive without extracting it (and imported from it with
+--respect-all).
 
 The <exclude_path>s can be files and/or directories that will be excluded
-from generation.
+from generation. They can also be patterns: globs like '*/tests/*' (relative
+to the current directory, excluding whole subtrees) or '*_pb2.py' (matching
+names anywhere), and regular expressions prefixed with 're:'.
 
 Note: By default this script will not overwrite already created files.""")
 
@@ -354,6 +1074,9 @@ Note: By default this script will not overwrite already created files.""")
                       '(default: 4)', type='int', default=4)
     parser.add_option('-f', '--force', action='store_true', dest='force',
                       help='Overwrite existing files')
+    parser.add_option('-u', '--update', action='store_true', dest='update',
+                      help='Overwrite existing files but only if their '
+                      'content changed (keeps Sphinx builds incremental)')
     parser.add_option('-l', '--follow-links', action='store_true',
                       dest='followlinks', default=False,
                       help='Follow symbolic links. Powerful when combined '
@@ -391,6 +1114,15 @@ Note: By default this script will not overwrite already created files.""")
     parser.add_option('-R', '--doc-release', action='store', dest='release',
                       help='Project release, used when --full is given, '
                       'defaults to --doc-version')
+    parser.add_option('--plan', action='store_true', dest='plan',
+                      help='Write nothing, list the files that would be '
+                      'added or changed and the orphaned ones in the output '
+                      'directory (compared with the --manifest of the '
+                      'previous run if given)')
+    parser.add_option('--prune', action='store_true', dest='prune',
+                      help='Remove the orphaned files that the previous run '
+                      'generated, according to its --manifest (required); '
+                      'other files are kept')
     parser.add_option('--version', action='store_true', dest='show_version',
                       help='Show version information and exit')
     parser.add_option('--respect-all', action='store_true',
@@ -402,25 +1134,149 @@ Note: By default this script will not overwrite already created files.""")
     parser.add_option('--ignore-errors', action='store_true',
                       dest='ignore_errors', 
                       help='Ignore import errors and continue')
+    parser.add_option('--no-static', action='store_true',
+                      dest='no_static',
+                      help='Always import the packages to find __all__ '
+                      'instead of parsing __init__.py first (slow)')
+    parser.add_option('--templates', action='store', dest='templates_dir',
+                      metavar='DIR',
+                      help='Override the page templates with the files in '
+                      'DIR: <fragment>.txt and package.layout (see '
+                      'templates.py)')
+    parser.add_option('--toc-max-entries', action='store', type='int',
+                      dest='toc_max_entries', default=0, metavar='N',
+                      help='Split a modules index of more than N entries '
+                      'into a tree of index pages of at most N entries '
+                      '(default: 0, one page)')
+    parser.add_option('--static-members', action='store_true',
+                      dest='static_members',
+                      help='List the members to document explicitly in each '
+                      'automodule directive: __all__ or the public names '
+                      'defined in the module, found by parsing it')
+    parser.add_option('-j', '--jobs', action='store', dest='jobs',
+                      type='int', default=1,
+                      help='Import the packages in N parallel processes with '
+                      '--respect-all (default: 1, import in this process)')
+    parser.add_option('--import-timeout', action='store', type='float',
+                      dest='import_timeout', metavar='SECONDS',
+                      help='Abort the import of a package that takes longer '
+                      'than SECONDS with --respect-all and go on without its '
+                      '__all__ (each import runs in a process of its own)')
+    parser.add_option('--import-memory', action='store', type='int',
+                      dest='import_memory', metavar='MB',
+                      help='Abort the import of a package that allocates '
+                      'more than MB megabytes with --respect-all, as '
+                      '--import-timeout (where supported, e.g. Linux)')
+    parser.add_option('--batch', action='store', dest='batch',
+                      metavar='FILE',
+                      help='Document all the roots listed in the config file '
+                      'FILE in this process, sharing the --respect-all cache, '
+                      'imports and --jobs worker processes (see batch.py)')
+    parser.add_option('--parallel-roots', action='store', type='int',
+                      dest='parallel_roots', default=4, metavar='N',
+                      help='Process N roots of --batch at the same time '
+                      '(default: 4)')
+    parser.add_option('-w', '--watch', action='store_true', dest='watch',
+                      help='Keep running and update the files whenever '
+                      'modules or packages are added, removed or renamed')
+    parser.add_option('-X', '--exclude-from', action='append',
+                      dest='exclude_from', default=[], metavar='FILE',
+                      help='Read exclude patterns from FILE, one per line '
+                      '(can be given more than once)')
+    parser.add_option('--since', action='store', dest='since', metavar='REV',
+                      help='Only regenerate the pages of the packages with '
+                      'files changed since the git revision REV (and the '
+                      'modules index if its entries changed), reusing the '
+                      'rest of the run recorded in --manifest')
+    parser.add_option('--archive', action='store', dest='archive',
+                      metavar='FILE',
+                      help='Write all the pages into the tar or zip archive '
+                      'FILE (- for stdout) instead of the output directory, '
+                      'sorted and with fixed timestamps (SOURCE_DATE_EPOCH '
+                      'or 1980-01-01) so that it is reproducible')
+    parser.add_option('--archive-format', action='store', type='choice',
+                      dest='archive_format', choices=['tar', 'tar.gz', 'zip'],
+                      help='tar, tar.gz or zip (default: by the suffix of '
+                      'the --archive file, tar for stdout)')
+    parser.add_option('--manifest', action='store', dest='manifest_file',
+                      metavar='FILE',
+                      help='Write a JSON description of the documented '
+                      'packages and of the generated files to FILE')
+    parser.add_option('--stats', action='store_true', dest='print_stats',
+                      help='Print the time spent in each phase, counters '
+                      'and the slowest packages at the end')
+    parser.add_option('--stats-json', action='store', dest='stats_file',
+                      metavar='FILE',
+                      help='Save the same statistics as JSON to FILE')
+    parser.add_option('--stats-top', action='store', dest='stats_top',
+                      type='int', default=10, metavar='N',
+                      help='Number of slowest packages to list (default: 10)')
+    parser.add_option('--profile-imports', action='store_true',
+                      dest='print_import_profile',
+                      help='Print the cost of each package import of '
+                      '--respect-all at the end, the slowest first: the '
+                      'time, the modules loaded and the memory growth')
+    parser.add_option('--profile-imports-json', action='store',
+                      dest='import_profile_file', metavar='FILE',
+                      help='Save the same import profile as JSON to FILE, '
+                      'with the names of the modules loaded')
+    parser.add_option('--write-threads', action='store', type='int',
+                      dest='write_threads', default=4,
+                      help='Write the files on N threads (default: 4)')
+    parser.add_option('--cache-file', action='store', dest='cache_file',
+                      help='Where to keep the __all__ lookups of '
+                      '--respect-all and the members of --static-members '
+                      'between runs (default: <output_path>/%s, none with '
+                      '--archive or with --batch without -o)' %
+                      pkgcache.CACHE_NAME)
+    parser.add_option('--no-cache', action='store_true', dest='no_cache',
+                      help='Neither read nor write the cache file')
+    parser.add_option('--clear-cache', action='store_true',
+                      dest='clear_cache',
+                      help='Ignore the cache file and write it anew')
+    return parser
+
+
+def main(argv=sys.argv):
+    """Parse and check the command line arguments."""
+    parser = make_parser()
     (opts, args) = parser.parse_args(argv[1:])
 
     if opts.show_version:
-        print('Sphinx (sphinx-apidoc) %s' %  __version__)
+        print('Sphinx (sphinx-apidoc) %s' %  sphinx_version())
         return 0
 
+    if opts.batch:
+        import batch
+        return batch.run_batch(opts.batch, opts)
+
     if not args:
         parser.error('A package path is required.')
 
-    rootpath, excludes = args[0], args[1:]
-    if not opts.destdir:
+    rootpath, excludes = check_options(parser, opts, args[0], args[1:])
+    return run(rootpath, excludes, opts)
+
+
+def check_options(parser, opts, rootpath, excludes):
+    """Checks the options and returns the absolute ``rootpath`` and the
+    ``excludes`` as a ``matcher.Matcher``; exits on error."""
+    if not opts.destdir and not opts.archive:
         parser.error('An output directory is required.')
     if opts.header is None:
-        opts.header = os.path.normpath(rootpath).split(os.sep)[-1]
+        opts.header = project_name(rootpath)
     if opts.suffix.startswith('.'):
         opts.suffix = opts.suffix[1:]
-    if not os.path.isdir(rootpath):
-        print('%s is not a directory.' % rootpath, file=sys.stderr)
+    if not os.path.isdir(rootpath) and not walker.is_archive(rootpath):
+        print('%s is not a directory, a wheel, an egg or a zip file.' %
+              rootpath, file=sys.stderr)
         sys.exit(1)
+    try:
+        excludes = matcher.Matcher(excludes)
+        for filename in opts.exclude_from:
+            excludes.add(matcher.read_patterns(filename),
+                         os.path.dirname(os.path.abspath(filename)))
+    except matcher.PatternError as e:
+        parser.error(str(e))
     if opts.includeprivate and opts.respect_all:
         msg = 'Either --private or --respect-all but not both'
         print(msg, file=sys.stderr)
@@ -429,21 +1285,134 @@ Note: By default this script will not overwrite already created files.""")
         msg = 'The --ignore-errors flag is only meaningful with --respect-all'
         print(msg, file=sys.stderr)
         sys.exit(1)
-    if not os.path.isdir(opts.destdir):
-        if not opts.dryrun:
+    if opts.full and not opts.dryrun:
+        try:
+            from sphinx import quickstart
+        except ImportError:
+            print('The --full option requires Sphinx', file=sys.stderr)
+            sys.exit(1)
+    if opts.full and opts.watch:
+        msg = 'Either --full or --watch but not both'
+        print(msg, file=sys.stderr)
+        sys.exit(1)
+    if opts.jobs < 1:
+        parser.error('The number of jobs must be at least 1.')
+    if opts.toc_max_entries < 0 or opts.toc_max_entries == 1:
+        parser.error('The index pages need room for at least 2 entries.')
+    if opts.write_threads < 1:
+        parser.error('The number of write threads must be at least 1.')
+    if (opts.import_timeout is not None or opts.import_memory is not None) \
+       and not opts.respect_all:
+        msg = 'The --import-timeout and --import-memory options are only ' \
+              'meaningful with --respect-all'
+        print(msg, file=sys.stderr)
+        sys.exit(1)
+    if (opts.import_timeout is not None and opts.import_timeout <= 0) or \
+       (opts.import_memory is not None and opts.import_memory <= 0):
+        parser.error('The import budget must be positive.')
+    if (opts.print_import_profile or opts.import_profile_file) and \
+       not opts.respect_all:
+        msg = 'The --profile-imports options are only meaningful with ' \
+              '--respect-all'
+        print(msg, file=sys.stderr)
+        sys.exit(1)
+    if opts.no_static and not opts.respect_all:
+        msg = 'The --no-static flag is only meaningful with --respect-all'
+        print(msg, file=sys.stderr)
+        sys.exit(1)
+    if opts.prune and not opts.manifest_file:
+        msg = 'The --prune flag needs the --manifest of the previous run'
+        print(msg, file=sys.stderr)
+        sys.exit(1)
+    if opts.since and not opts.manifest_file:
+        msg = 'The --since option needs the --manifest of the previous run'
+        print(msg, file=sys.stderr)
+        sys.exit(1)
+    if opts.since and (opts.full or opts.watch or opts.plan):
+        msg = 'The --since option cannot be combined with --full, --watch ' \
+              'or --plan'
+        print(msg, file=sys.stderr)
+        sys.exit(1)
+    if opts.plan and (opts.full or opts.watch):
+        msg = 'The --plan flag cannot be combined with --full or --watch'
+        print(msg, file=sys.stderr)
+        sys.exit(1)
+    if opts.archive:
+        if opts.full or opts.watch or opts.plan or opts.since or opts.prune:
+            msg = 'The --archive option cannot be combined with --full, ' \
+                  '--watch, --plan, --since or --prune'
+            print(msg, file=sys.stderr)
+            sys.exit(1)
+        if opts.archive_format is None:
+            opts.archive_format = writer.archive_format(opts.archive) or 'tar'
+        if opts.archive == '-':  # the messages go to stderr then
+            opts.archive_stream = getattr(sys.stdout, 'buffer', sys.stdout)
+            sys.stdout = sys.stderr
+    elif not os.path.isdir(opts.destdir):
+        if not opts.dryrun and not opts.plan:
             os.makedirs(opts.destdir)
+    try:
+        opts.templates = templates.Templates(opts.templates_dir)
+    except templates.TemplateError as e:
+        print(e, file=sys.stderr)
+        sys.exit(1)
+    opts.stats = stats.Stats()
+    if opts.print_import_profile or opts.import_profile_file:
+        import profiler
+        opts.profiler = profiler.Profiler()
     rootpath =   os.path.normpath(os.path.abspath(rootpath))
-    excludes = { os.path.normpath(os.path.abspath(excl)) for excl in excludes }
-    modules = walk_dir_tree(rootpath, excludes, opts)
+    return rootpath, excludes
+
+
+def run(rootpath, excludes, opts):
+    """Generates the files of ``rootpath`` with the checked options, see
+    ``check_options``."""
+    walker.forget_tree(rootpath)  # it may have changed since the last call
+    if (opts.respect_all or opts.static_members) and \
+       getattr(opts, 'cache', None) is None:
+        opts.cache = pkgcache.open_cache(opts)
+    previous = None
+    if opts.plan or opts.prune:
+        import plan
+        previous = plan.previous_files(opts.manifest_file)
+    if opts.plan:
+        get_stats(opts)  # shared with the copy of generate
+        pages = ((output_file(docname, opts), text) for docname, text in
+                 generate(rootpath, excludes, opts))
+        print(plan.report(plan.compare(pages, opts.destdir, opts.suffix,
+                                       previous), previous))
+        return 0
+    if opts.prune:
+        opts.generated = set()
+    if opts.watch:
+        import watch  # ctypes is slow to import
+        watch.watch(rootpath, opts,
+                    lambda: regenerate(rootpath, excludes, opts))
+        return 0
+    previous_run = None
+    if opts.since:
+        import since
+        try:
+            changed = since.changed_paths(rootpath, opts.since)
+        except since.GitError as e:
+            print('--since %s: %s' % (opts.since, e), file=sys.stderr)
+            sys.exit(1)
+        previous_run = since_manifest(rootpath, excludes, opts)
+    open_writer(opts)
+    open_manifest(rootpath, excludes, opts)
+    with phase(opts, 'walk'):
+        if previous_run is not None:
+            update_since(rootpath, excludes, opts, previous_run, changed)
+        else:
+            modules = walk_dir_tree(rootpath, excludes, opts)
+    save_cache(opts)
     if opts.full:
-        modules.sort()
-        prev_module = ''
-        text = ''
-        for module in modules:
-            if module.startswith(prev_module + '.'):
-                continue
-            prev_module = module
-            text += '   %s\n' % module
+        entries = list(toc_entries(modules))
+        if is_sharded(entries, opts):
+            with phase(opts, 'build'):
+                create_modules_toc_file(modules, opts)
+            entries = ['modules']
+        text = templates.render(get_templates(opts).entries, entries)
         d = dict(
             path = opts.destdir,
             sep  = False,
@@ -465,8 +1434,36 @@ Note: By default this script will not overwrite already created files.""")
         if not opts.dryrun:
             from sphinx import quickstart as qs
             qs.generate(d, silent=True, overwrite=opts.force)
-    elif not opts.notoc:
-        create_modules_toc_file(modules, opts)
+    elif not opts.notoc and previous_run is None:
+        with phase(opts, 'build'):
+            create_modules_toc_file(modules, opts)
+    close_writer(opts)
+    save_manifest(opts)
+    if opts.prune:
+        if previous_run is not None:  # the pages taken over count too
+            import manifest
+            opts.generated = set(manifest.generated_files(opts.manifest.data))
+        prune_orphans(previous, opts)
+    if not opts.dryrun:
+        report_written_files(opts)
+    if previous_run is not None:
+        wrapped_print('%d package(s) rebuilt since %s.' %
+                      (opts.stats.get('packages_rebuilt'), opts.since), opts)
+    if opts.respect_all:
+        wrapped_print('%d package(s) had to be imported to find __all__.' %
+                      opts.stats.get('packages_imported'), opts)
+        report_over_budget_packages(opts)
+    if getattr(opts, 'cache', None) is not None:
+        opts.stats.count('cache_hits', opts.cache.hits)
+        opts.stats.count('cache_misses', opts.cache.misses)
+    if opts.print_stats:
+        print(opts.stats.report(opts.stats_top))
+    if opts.stats_file:
+        opts.stats.save(opts.stats_file, opts.stats_top)
+    if opts.print_import_profile:
+        print(opts.profiler.report())
+    if opts.import_profile_file:
+        opts.profiler.save(opts.import_profile_file)
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,75 @@
+from __future__ import print_function
+import json
+import os
+
+# Machine readable description of the documented tree (--manifest): the
+# packages with their modules and subpackages, what --respect-all decided
+# and which files were generated for them, and the options that shaped the
+# pages, so that --since can tell whether it may reuse them.
+
+FORMAT = 1
+
+
+class Manifest(object):
+
+    def __init__(self, rootpath, destdir, suffix, options=None):
+        self.data = { 'format': FORMAT,
+                      'root': rootpath,
+                      'root_package': None,
+                      'destdir': os.path.abspath(destdir),
+                      'suffix': suffix,
+                      'options': options,
+                      'modules': [],
+                      'packages': [],
+                      'toc': None,
+                      'toc_shards': [] }
+
+    def add_module(self, name, fname):
+        """A top level module, documented on its own page."""
+        self.data['modules'].append({ 'name': name, 'file': fname })
+
+    def save(self, filename):
+        tmp = filename + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(self.data, f, indent=1, sort_keys=True)
+            f.write('\n')
+        getattr(os, 'replace', os.rename)(tmp, filename)
+
+
+def package_entry(name, path, modules, subpackages, fname, module_files=(),
+                  all_attr=None, all_source=None, has_docstr=None):
+    """The entry of a package page; ``all_source`` tells where ``__all__``
+    came from: ``'static'``, ``'import'``, ``'error'`` (ignored import
+    error) or ``None`` if it was not looked at (no --respect-all)."""
+    return { 'name': name,
+             'path': path,
+             'modules': list(modules),
+             'subpackages': list(subpackages),
+             'file': fname,
+             'module_files': list(module_files),
+             'all': all_attr,
+             'all_source': all_source,
+             'has_docstring': has_docstr }
+
+
+def load(filename):
+    """Returns the manifest written by ``Manifest.save`` as a dict, or
+    ``None`` if it is missing, unreadable or of another format."""
+    try:
+        with open(filename) as f:
+            data = json.load(f)
+    except (IOError, OSError, ValueError):
+        return None
+    return data if data.get('format') == FORMAT else None
+
+
+def generated_files(data):
+    """All the files listed in a loaded manifest."""
+    files = [m['file'] for m in data['modules']]
+    for pkg in data['packages']:
+        files.append(pkg['file'])
+        files.extend(pkg['module_files'])
+    if data['toc']:
+        files.append(data['toc'])
+    files.extend(data.get('toc_shards', []))
+    return files
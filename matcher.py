@@ -0,0 +1,128 @@
+from __future__ import print_function
+import fnmatch
+import os
+import re
+
+# Exclude patterns compiled once. Literal paths go into a set, and so do the
+# common name globs ``*suffix`` and ``prefix*`` (one set per length of the
+# fixed part), so the cost of a lookup does not grow with the number of these
+# patterns. The other globs are combined into a single regular expression,
+# which the regex engine still tries one alternative after the other. The
+# ``re:`` patterns are compiled one by one, as they may use global flags or
+# backreferences that would not survive being combined.
+
+GLOB_CHARS = re.compile(r'[*?[]')
+REGEX_PREFIX = 're:'
+
+
+class PatternError(Exception):
+    pass
+
+
+class Matcher(object):
+    """Supports ``path in matcher`` for normalized absolute paths, so it can
+    stand in for the set of excluded paths. The patterns can be
+
+    * paths (absolute or relative to ``base``), excluding exactly that file
+      or directory;
+    * globs containing a separator, relative to ``base`` like the paths;
+      ``*`` also matches across directories, and directories are tried with
+      a trailing separator too, so ``*/tests/*`` prunes every ``tests``
+      directory itself and not just its contents;
+    * globs without a separator (``*_pb2.py``), matching the file or
+      directory name anywhere in the tree;
+    * regular expressions prefixed with ``re:``, searched in the absolute
+      path.
+    """
+
+    def __init__(self, patterns=(), base=None):
+        self.paths = set()
+        self.name_suffixes, self.name_prefixes = {}, {}  # length -> set
+        self.name_globs, self.path_globs, self.regexes = [], [], []
+        self.compiled = []  # the regexes
+        self.add(patterns, base)
+
+    def add(self, patterns, base=None):
+        base = base or os.getcwd()
+        for pattern in patterns:
+            if pattern.startswith(REGEX_PREFIX):
+                regex = pattern[len(REGEX_PREFIX):]
+                try:
+                    self.compiled.append(re.compile(regex))
+                except re.error as e:
+                    raise PatternError('Invalid exclude pattern %s: %s' %
+                                       (pattern, e))
+                self.regexes.append(regex)
+            elif not GLOB_CHARS.search(pattern):
+                self.paths.add(normalize(pattern, base))
+            elif os.sep in pattern or (os.altsep or os.sep) in pattern:
+                self.path_globs.append(fnmatch.translate(
+                                                    normalize(pattern, base)))
+            else:
+                self.add_name_glob(os.path.normcase(pattern))
+        self.name_regex = combine(self.name_globs)
+        self.path_regex = combine(self.path_globs)
+
+    def add_name_glob(self, pattern):
+        if pattern.startswith('*') and not GLOB_CHARS.search(pattern[1:]) \
+           and len(pattern) > 1:
+            fixed = pattern[1:]
+            self.name_suffixes.setdefault(len(fixed), set()).add(fixed)
+        elif pattern.endswith('*') and not GLOB_CHARS.search(pattern[:-1]) \
+             and len(pattern) > 1:
+            fixed = pattern[:-1]
+            self.name_prefixes.setdefault(len(fixed), set()).add(fixed)
+        else:
+            self.name_globs.append(fnmatch.translate(pattern))
+
+    def __contains__(self, path):
+        path = os.path.normcase(path)
+        if path in self.paths:
+            return True
+        name = os.path.basename(path)
+        for length, suffixes in self.name_suffixes.items():
+            if name[-length:] in suffixes:
+                return True
+        for length, prefixes in self.name_prefixes.items():
+            if name[:length] in prefixes:
+                return True
+        if self.name_regex and self.name_regex.match(name):
+            return True
+        if self.path_regex and (self.path_regex.match(path) or
+                                self.path_regex.match(path + os.sep)):
+            return True
+        return any(regex.search(path) for regex in self.compiled)
+
+    def describe(self):
+        """The normalized patterns, to tell whether another run excluded the
+        same paths."""
+        def fixed(by_length):
+            return sorted(s for strings in by_length.values() for s in strings)
+        return { 'paths': sorted(self.paths), 'name_globs': self.name_globs,
+                 'name_suffixes': fixed(self.name_suffixes),
+                 'name_prefixes': fixed(self.name_prefixes),
+                 'path_globs': self.path_globs, 'regexes': self.regexes }
+
+
+def normalize(path, base):
+    path = os.path.join(base, os.path.expanduser(path))
+    return os.path.normcase(os.path.normpath(path))
+
+
+def combine(regexes):
+    if not regexes:
+        return None
+    return re.compile('|'.join('(?:%s)' % r for r in regexes))
+
+
+def read_patterns(filename):
+    """Reads the --exclude-from file: one pattern per line, blank lines and
+    lines starting with ``#`` are ignored. Relative patterns are relative to
+    the directory of the file."""
+    try:
+        with open(filename) as f:
+            lines = [line.strip() for line in f]
+    except (IOError, OSError) as e:
+        raise PatternError('Cannot read the exclude file %s: %s' %
+                           (filename, e))
+    return [line for line in lines if line and not line.startswith('#')]
@@ -0,0 +1,182 @@
+from __future__ import print_function
+import os
+import sys
+
+import walker
+
+# Persistent cache for the __all__ and docstring lookups of --respect-all.
+# The entries are keyed by the path of the __init__ file and are validated
+# against its size, mtime and content hash; the whole file is discarded if it
+# was written by a different interpreter. The members of wheels and zip files
+# have the mtime of the archive (see walker.ArchiveEntry).
+
+CACHE_NAME = '.apidocfilter-cache.json'
+FORMAT = 2  # 2: --static-members skips fallbacks of failed imports
+
+
+class Cache(object):
+    """Maps ``__init__`` files to ``(all_attr, has_docstr)`` tuples. Without a
+    ``filename`` the cache only lives as long as the process."""
+
+    def __init__(self, filename=None, load=True):
+        self.filename = filename
+        self.entries = {}  # persistent: only successful lookups
+        self.members = {}  # persistent: module file -> --static-members
+        self.results = {}  # this run, ignored errors included
+        self.sources = {}  # this run: 'static', 'import' or 'error'
+        self.dirty = False
+        self.hits = 0
+        self.misses = 0
+        if filename and load:
+            self.load()
+        elif filename:
+            self.dirty = True
+
+    def load(self):
+        import json  # only needed with a cache file
+        try:
+            with open(self.filename) as f:
+                data = json.load(f)
+        except (IOError, OSError, ValueError):
+            return  # missing or corrupt, start from scratch
+        if data.get('format') != FORMAT or data.get('python') != sys.version:
+            self.dirty = True
+            return
+        self.entries = data.get('packages', {})
+        self.members = data.get('members', {})
+
+    def save(self):
+        if not self.filename or not self.dirty:
+            return
+        self.evict_deleted()
+        import json
+        data = { 'format': FORMAT, 'python': sys.version,
+                 'packages': self.entries, 'members': self.members }
+        tmp = self.filename + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(data, f, sort_keys=True)
+        getattr(os, 'replace', os.rename)(tmp, self.filename)
+        self.dirty = False
+
+    def evict_deleted(self):
+        for initfile in list(self.entries):
+            if initfile not in self.results and not walker.isfile(initfile):
+                del self.entries[initfile]
+        for filename in list(self.members):
+            if not walker.isfile(filename):
+                del self.members[filename]
+
+    def get(self, initfile, sources=('static', 'import')):
+        """Returns the cached ``(all_attr, has_docstr)`` tuple or ``None`` if
+        it is missing or stale. Stale entries are evicted."""
+        if initfile in self.results:
+            return self.results[initfile]
+        entry = self.entries.get(initfile)
+        mtime = entry and entry['mtime']
+        if entry is not None and entry['source'] in sources and \
+           is_fresh(entry, initfile):
+            self.dirty |= entry['mtime'] != mtime
+            self.hits += 1
+            self.results[initfile] = (entry['all'], entry['doc'])
+            self.sources[initfile] = entry['source']
+            return self.results[initfile]
+        if entry is not None:
+            del self.entries[initfile]
+            self.dirty = True
+        self.misses += 1
+        return None
+
+    def put(self, initfile, result, source=None):
+        """Records the result of a lookup; it is only persisted if ``source``
+        (``'static'`` or ``'import'``) is given, ignored import errors are
+        not."""
+        self.results[initfile] = result
+        self.sources[initfile] = source or 'error'
+        if source is None:
+            return
+        try:
+            entry = stat_entry(initfile)
+        except (IOError, OSError):
+            return
+        entry.update({'all': result[0], 'doc': result[1], 'source': source})
+        self.entries[initfile] = entry
+        self.dirty = True
+
+    def get_members(self, filename):
+        """Returns the cached member list of the module ``filename`` (see
+        ``astscan.module_members``) or ``None`` if it is missing or stale."""
+        entry = self.members.get(filename)
+        mtime = entry and entry['mtime']
+        if entry is not None and is_fresh(entry, filename):
+            self.dirty |= entry['mtime'] != mtime
+            self.hits += 1
+            return entry['members']
+        if entry is not None:
+            del self.members[filename]
+            self.dirty = True
+        self.misses += 1
+        return None
+
+    def put_members(self, filename, members):
+        try:
+            entry = stat_entry(filename)
+        except (IOError, OSError):
+            return
+        entry['members'] = members
+        self.members[filename] = entry
+        self.dirty = True
+
+    def forget(self, path):
+        """Forgets the lookups done in this run for ``path``, an ``__init__``
+        file or a directory, so that they are validated again."""
+        prefix = os.path.join(path, '')
+        for initfile in list(self.results):
+            if initfile == path or initfile.startswith(prefix):
+                del self.results[initfile]
+                self.sources.pop(initfile, None)
+
+    def source(self, initfile):
+        """Where the result of this run came from, see ``put``."""
+        return self.sources.get(initfile)
+
+
+def is_fresh(entry, initfile):
+    try:
+        st = walker.stat_file(initfile)
+        if st.st_size != entry['size']:
+            return False
+        if st.st_mtime == entry['mtime']:
+            return True
+        # Touched (e.g. by a checkout) but maybe not modified
+        if file_hash(initfile) != entry['sha1']:
+            return False
+    except (IOError, OSError):
+        return False
+    entry['mtime'] = st.st_mtime
+    return True
+
+
+def stat_entry(initfile):
+    st = walker.stat_file(initfile)
+    return { 'size': st.st_size, 'mtime': st.st_mtime,
+             'sha1': file_hash(initfile) }
+
+
+def file_hash(filename):
+    import hashlib  # slow to import, only needed on the first run
+    return hashlib.sha1(walker.read(filename)).hexdigest()
+
+
+def open_cache(opts):
+    """Creates the cache as dictated by the --cache-file, --no-cache and
+    --clear-cache options. Without --cache-file it is kept in the output
+    directory, or only in memory if there is none (--archive, or --batch
+    without -o)."""
+    if getattr(opts, 'no_cache', False):
+        return Cache()
+    filename = getattr(opts, 'cache_file', None)
+    if not filename:
+        if getattr(opts, 'archive', None) or not opts.destdir:
+            return Cache()
+        filename = os.path.join(opts.destdir, CACHE_NAME)
+    return Cache(filename, load=not getattr(opts, 'clear_cache', False))
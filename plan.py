@@ -0,0 +1,95 @@
+from __future__ import print_function
+import os
+
+import manifest
+import writer
+
+# Plan mode (--plan) and pruning (--prune). The generated pages are compared
+# with the output directory: they are added, changed or unchanged, and the
+# other files with the suffix of the pages (and those of the previous
+# manifest) are orphaned. Only orphans that this tool generated are pruned:
+# those listed in the manifest of the previous run (--manifest, which
+# --prune needs), as a hand written page may look just like a generated one.
+
+STATES = ('added', 'changed', 'unchanged', 'orphaned')
+
+
+def previous_files(manifest_file):
+    """The files listed in the manifest of the previous run (normalized), or
+    ``None`` if there is none."""
+    if not manifest_file:
+        return None
+    data = manifest.load(manifest_file)
+    if data is None:
+        return None
+    return set(normalize(fname) for fname in manifest.generated_files(data))
+
+
+def compare(pages, destdir, suffix, previous=None):
+    """Compares the ``(fname, text)`` ``pages`` with ``destdir`` and returns
+    a dict mapping the ``STATES`` to sorted lists of files."""
+    result = dict((state, []) for state in STATES)
+    generated = set()
+    for fname, text in pages:
+        generated.add(normalize(fname))
+        if not os.path.isfile(fname):
+            result['added'].append(fname)
+        elif writer.has_content(fname, text):
+            result['unchanged'].append(fname)
+        else:
+            result['changed'].append(fname)
+    result['orphaned'] = orphans(generated, destdir, suffix, previous)
+    for files in result.values():
+        files.sort()
+    return result
+
+
+def orphans(generated, destdir, suffix, previous=None):
+    """The files of ``destdir`` with the ``suffix`` (and those of the
+    ``previous`` manifest that still exist in it) that are not ``generated``
+    (a set of normalized file names)."""
+    candidates = {}  # normalized -> as shown
+    if previous:  # never anything outside of destdir
+        inside = os.path.join(normalize(destdir), '')
+        candidates.update((fname, fname) for fname in previous
+                          if fname.startswith(inside) and
+                          os.path.isfile(fname))
+    if os.path.isdir(destdir):
+        for name in os.listdir(destdir):
+            if name.endswith('.' + suffix):
+                fname = os.path.join(destdir, name)
+                candidates[normalize(fname)] = fname
+    return sorted(fname for key, fname in candidates.items()
+                  if key not in generated)
+
+
+def is_generated(fname, previous=None):
+    """Whether ``fname`` is listed in the ``previous`` manifest; without one
+    nothing counts as generated."""
+    return previous is not None and normalize(fname) in previous
+
+
+def report(result, previous=None):
+    """The plan as text: the added, changed and orphaned files and a summary
+    line."""
+    lines = []
+    for state in ('added', 'changed'):
+        lines.extend('%-9s %s' % (state, fname) for fname in result[state])
+    to_prune = 0
+    for fname in result['orphaned']:
+        if is_generated(fname, previous):
+            to_prune += 1
+            note = 'generated, --prune removes it'
+        else:
+            note = 'not generated, kept'
+        lines.append('%-9s %s (%s)' % ('orphaned', fname, note))
+    lines.append('%d added, %d changed, %d unchanged, %d orphaned (%d '
+                 'generated).' % (len(result['added']),
+                                  len(result['changed']),
+                                  len(result['unchanged']),
+                                  len(result['orphaned']), to_prune))
+    return '\n'.join(lines)
+
+
+def normalize(fname):
+    return os.path.normcase(os.path.abspath(fname))
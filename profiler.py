@@ -0,0 +1,117 @@
+from __future__ import print_function
+import sys
+import time
+
+# Import cost profile (--profile-imports): for each package that --respect-all
+# had to import, the wall time of the import, the modules it loaded and how
+# much memory that took. A module is attributed to the first package that
+# loads it, as the imports of a top level package share ``sys.modules`` (see
+# ``session``). The memory is the growth of the peak RSS of the process and,
+# where tracemalloc is available (Python 3.4+), the peak of the allocations
+# traced during the import.
+
+
+class Profiler(object):
+    """The cost of the imports, one record per package path, see
+    ``measure``."""
+
+    def __init__(self):
+        self.records = {}
+
+    def add(self, path, pkg, record):
+        record = dict(record, path=path, package=pkg)
+        self.records[path] = record
+
+    def sorted(self):
+        """The records, the most expensive first: by time, then by the
+        number of modules loaded."""
+        return sorted(self.records.values(),
+                      key=lambda r: (-r['seconds'], -r['module_count'],
+                                     r['package']))
+
+    def report(self, top=None):
+        records = self.sorted()[:top]
+        lines = ['Import profile (%d package(s), the slowest first):' %
+                 len(self.records),
+                 '  %9s %8s %10s %10s  %s' % ('seconds', 'modules', 'peak RSS',
+                                              'traced', 'package')]
+        for r in records:
+            lines.append('  %9.3f %8d %10s %10s  %s' %
+                         (r['seconds'], r['module_count'],
+                          megabytes(r['rss_growth']),
+                          megabytes(r['traced_peak']), r['package']))
+        return '\n'.join(lines)
+
+    def save(self, filename):
+        import json
+        with open(filename, 'w') as f:
+            json.dump({ 'packages': self.sorted() }, f, indent=1,
+                      sort_keys=True)
+            f.write('\n')
+
+
+def measure(load, *args):
+    """Calls ``load(*args)``, an import, and returns its value and the record
+    of its cost: ``seconds``, ``modules`` (the names of the modules that were
+    not loaded yet), ``module_count``, ``rss_growth`` and ``traced_peak``
+    (in bytes, ``None`` if unknown). Tracing the allocations slows down
+    everything, so it only lasts as long as the import."""
+    tracemalloc, started = start_tracemalloc()
+    try:
+        modules_before = set(sys.modules)
+        rss_before = peak_rss()
+        traced_before = 0
+        if tracemalloc is not None:
+            traced_before = tracemalloc.get_traced_memory()[0]
+            if hasattr(tracemalloc, 'reset_peak'):  # Python 3.9+
+                tracemalloc.reset_peak()
+        start = time.time()
+        value = load(*args)
+        seconds = time.time() - start
+        traced_peak = None
+        if tracemalloc is not None:
+            current, peak = tracemalloc.get_traced_memory()
+            if not started and not hasattr(tracemalloc, 'reset_peak'):
+                peak = current  # the peak since tracing started would mislead
+            traced_peak = max(peak - traced_before, 0)
+    finally:
+        if started:
+            tracemalloc.stop()
+    rss_growth = None
+    if rss_before is not None:
+        rss_growth = peak_rss() - rss_before
+    modules = sorted(set(sys.modules) - modules_before)
+    return value, { 'seconds': round(seconds, 6), 'modules': modules,
+                    'module_count': len(modules), 'rss_growth': rss_growth,
+                    'traced_peak': traced_peak }
+
+
+def start_tracemalloc():
+    """The tracemalloc module, tracing, or ``None`` if it is missing; and
+    whether the tracing was started here (it may have been started by
+    ``python -X tracemalloc``, then it is left on)."""
+    try:
+        import tracemalloc
+    except ImportError:  # Python 2
+        return None, False
+    if tracemalloc.is_tracing():
+        return tracemalloc, False
+    tracemalloc.start()
+    return tracemalloc, True
+
+
+def peak_rss():
+    """The peak resident set size of this process in bytes, ``None`` where
+    the resource module is missing."""
+    try:
+        import resource
+    except ImportError:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss if sys.platform == 'darwin' else rss * 1024
+
+
+def megabytes(nbytes):
+    if nbytes is None:
+        return '-'
+    return '%.1f MB' % (nbytes / (1024.0 * 1024))
@@ -0,0 +1,67 @@
+from __future__ import print_function
+import sys
+import threading
+
+# The in-process imports of --respect-all. The walk is depth first, so the
+# packages of one top level package are imported one after the other: they
+# share a session that keeps the ancestors in sys.modules until the walk
+# leaves the top level package. Only then is the package (its modules, not
+# the dependencies it imported on the way, which the next packages may need
+# too) removed from sys.modules, and its directory from sys.path. Every
+# thread of --batch has its own session, but sys.modules and sys.path belong
+# to the process: two roots may have top level packages of the same name, or
+# one of them may shadow the other on sys.path. So a session holds ``LOCK``
+# from ``enter`` to ``close``, and the other threads wait for it to import.
+
+LOCK = threading.RLock()
+
+
+class ImportSession(object):
+    """Imports packages, see ``load``. With ``keep_modules`` the imported
+    modules stay in ``sys.modules`` even after ``close`` (only ``sys.path``
+    is restored), as the Sphinx extension wants for autodoc."""
+
+    def __init__(self, keep_modules=False):
+        self.keep_modules = keep_modules
+        self.lock = LOCK
+        self.top = None  # (head, top level package) of the open session
+
+    def load(self, head, pkg):
+        """Imports ``pkg`` (a dotted name) found in the directory ``head`` and
+        returns the module, in the session of its top level package (see
+        ``enter``)."""
+        with self.lock:
+            self.enter(head, pkg)
+            __import__(pkg)  # for Python 2.6 compatibility
+            return sys.modules[pkg]
+
+    def enter(self, head, pkg):
+        """Switches to a new session if ``pkg`` belongs to another top level
+        package than the previous one."""
+        top = (head, pkg.split('.')[0])
+        if top != self.top:
+            self.close()
+            self.lock.acquire()  # released by close
+            self.top = top
+            sys.path.append(head)  # Prepend or append?
+
+    def close(self):
+        """Removes the modules of the top level package from ``sys.modules``
+        and its directory from ``sys.path``, and lets the other sessions
+        import."""
+        if self.top is None:
+            return
+        try:
+            head, name = self.top
+            if not self.keep_modules:
+                prefix = name + '.'
+                for module in [m for m in sys.modules
+                               if m == name or m.startswith(prefix)]:
+                    del sys.modules[module]
+            for i in range(len(sys.path) - 1, -1, -1):  # the one we appended
+                if sys.path[i] == head:
+                    del sys.path[i]
+                    break
+        finally:
+            self.top = None
+            self.lock.release()
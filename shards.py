@@ -0,0 +1,114 @@
+from __future__ import print_function
+
+# Splits a large modules index into a tree of small index pages
+# (--toc-max-entries), so that Sphinx resolves and renders many small
+# toctrees instead of a giant one. The entries are grouped by a prefix of
+# their name that gets longer with the depth in the tree: 'a', then 'ab', ...
+# (the entries are top level names, the subpackages are listed by the pages
+# of their packages, so there is no dotted hierarchy to follow). Consecutive
+# groups are put together in ranges ('ab-af'), so that no page lists more
+# than max_entries entries and the pages are not mostly empty.
+
+
+class Page(object):
+    """An index page: ``children`` are the pages it lists, or, on a leaf,
+    ``entries`` are the documents it lists. The root page has the
+    ``label`` ``None``."""
+
+    def __init__(self, docname, label, entries, children=()):
+        self.docname = docname
+        self.label = label
+        self.entries = entries
+        self.children = list(children)
+
+    def walk(self):
+        yield self
+        for child in self.children:
+            for page in child.walk():
+                yield page
+
+
+def shard(docname, entries, max_entries):
+    """Returns the root ``Page`` of the index tree of the sorted
+    ``entries``, ``docname`` being the name of the root page."""
+    return make_page(docname, None, list(entries), max(max_entries, 2), 1)
+
+
+def make_page(docname, label, entries, max_entries, depth):
+    if len(entries) <= max_entries:
+        return Page(docname, label, entries)
+    groups, depth = split(entries, depth)
+    if groups is None:  # duplicates cannot be told apart at any depth
+        return Page(docname, label, entries)
+    runs = ranges(groups, max_entries)
+    if any(len(group) >= len(entries) for _, group in runs):
+        return Page(docname, label, entries)  # would never get smaller
+    # a range of groups is split again at the same depth, a single group
+    # deeper (see split)
+    children = [ make_page('%s-%s' % (docname, group_label), group_label,
+                           group, max_entries, depth)
+                 for group_label, group in runs ]
+    return Page(docname, label, entries, children)
+
+
+def split(entries, depth):
+    """Groups the ``entries`` by their first characters, as many as the first
+    depth from ``depth`` on that gives more than one group; returns the ``[(label, entries)]`` groups
+    and that depth."""
+    longest = max(len(entry) for entry in entries)
+    while depth <= longest:
+        groups = []
+        for entry in entries:
+            label = entry[:depth]
+            if groups and groups[-1][0] == label:
+                groups[-1][1].append(entry)
+            else:
+                groups.append((label, [entry]))
+        if len(groups) > 1:
+            return groups, depth
+        depth += 1
+    return None, depth
+
+
+def ranges(groups, max_entries):
+    """Puts consecutive groups together into at most ``max_entries`` ranges,
+    labeled with their first and last label. The ranges are filled up to
+    the size of a subtree of a balanced tree, so the pages stay full; if
+    that puts all the groups in one range, they are spread evenly over
+    ``max_entries`` ranges instead."""
+    total = sum(len(group) for _, group in groups)
+    capacity = 1
+    while capacity * max_entries < total:
+        capacity *= max_entries
+    while True:
+        runs = [[]]
+        for label, group in groups:
+            if runs[-1] and sum(len(g) for _, g in runs[-1]) + len(group) > \
+               capacity:
+                runs.append([])
+            runs[-1].append((label, group))
+        if len(runs) <= max_entries:
+            break
+        capacity *= 2
+    if len(runs) == 1 and len(groups) > 1:
+        runs = even_runs(groups, min(max_entries, len(groups)))
+    return [ (run[0][0] if len(run) == 1 else
+              '%s-%s' % (run[0][0], run[-1][0]),
+              [entry for _, group in run for entry in group])
+             for run in runs ]
+
+
+def even_runs(groups, count):
+    """Puts consecutive groups together into ``count`` non-empty runs of
+    about the same number of entries."""
+    total = sum(len(group) for _, group in groups)
+    runs = [[]]
+    size = 0
+    for i, (label, group) in enumerate(groups):
+        if runs[-1] and len(runs) < count and \
+           (size >= total * len(runs) / float(count) or
+            len(groups) - i == count - len(runs)):
+            runs.append([])
+        runs[-1].append((label, group))
+        size += len(group)
+    return runs
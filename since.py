@@ -0,0 +1,73 @@
+from __future__ import print_function
+import os
+import subprocess
+import sys
+
+# Incremental mode (--since REV): asks git which files changed since a
+# revision (committed, staged, unstaged and untracked ones; a rename is a
+# deletion and an addition) and maps them to the packages whose pages they
+# may change. The rest of the pages are taken over from the previous run.
+
+INIT_FILES = ('__init__.py', '__init__.pyx')
+
+
+class GitError(Exception):
+    pass
+
+
+def changed_paths(rootpath, rev):
+    """The paths (under ``rootpath``) of the files that were added, modified
+    or deleted since the git revision ``rev``."""
+    top = git(rootpath, 'rev-parse', '--show-toplevel').strip()
+    names = git(rootpath, 'diff', '--name-only', '--no-renames', '-z', rev,
+                '--').split('\0')
+    names += git(rootpath, 'ls-files', '--others', '--exclude-standard',
+                 '--full-name', '-z').split('\0')
+    realroot = os.path.realpath(rootpath)
+    paths = set()
+    for name in names:
+        if not name:
+            continue
+        relpath = os.path.relpath(os.path.realpath(os.path.join(top, name)),
+                                  realroot)
+        if relpath != os.pardir and not relpath.startswith(os.pardir +
+                                                           os.sep):
+            paths.add(os.path.join(rootpath, relpath))
+    return sorted(paths)
+
+
+def affected_packages(rootpath, paths):
+    """The names of the packages (dotted, relative to ``rootpath``, '' for
+    the root) whose pages the changed ``paths`` may change: the package of
+    each file, and its parent too for an ``__init__`` file, as it decides
+    whether the package is documented at all."""
+    names = set()
+    for path in paths:
+        directory = os.path.dirname(path)
+        names.add(package_name(rootpath, directory))
+        if os.path.basename(path) in INIT_FILES and directory != rootpath:
+            names.add(package_name(rootpath, os.path.dirname(directory)))
+    return names
+
+
+def package_name(rootpath, directory):
+    relpath = os.path.relpath(directory, rootpath)
+    return '' if relpath == os.curdir else relpath.replace(os.sep, '.')
+
+
+def git(cwd, *args):
+    try:
+        proc = subprocess.Popen(('git',) + args, cwd=cwd,
+                                stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    except OSError as e:
+        raise GitError('Cannot run git: %s' % e)
+    out, err = proc.communicate()
+    if proc.returncode:
+        raise GitError(decode(err).strip() or 'git %s failed' % args[0])
+    return decode(out)
+
+
+def decode(output):
+    if isinstance(output, str):  # Python 2
+        return output
+    return output.decode(sys.getfilesystemencoding() or 'utf-8', 'replace')
@@ -0,0 +1,131 @@
+from __future__ import print_function
+import os
+
+from sphinx.errors import ExtensionError
+from sphinx.util import logging
+
+import hacked
+import matcher
+import pkgcache
+import templates
+import walker
+
+# Sphinx extension: generates the API pages inside the Sphinx process when the
+# builder is initialized, instead of running hacked.py as a separate step
+# before sphinx-build. In conf.py:
+#
+#     extensions = ['sphinx.ext.autodoc', 'sphinxext']
+#     apidoc_module_dir = '../mypackage'   # relative to the source directory
+#     apidoc_output_dir = 'api'            # idem
+#     apidoc_excluded_paths = ['tests', '*_pb2.py']
+#     apidoc_respect_all = True
+#
+# The excluded paths and patterns are relative to apidoc_module_dir and
+# apidoc_templates_dir (--templates) to the source directory. The other
+# config values mirror the command line options, see OPTIONS. Only the pages
+# whose text changed are written, so Sphinx only rereads those, and the
+# packages imported for --respect-all stay in sys.modules for autodoc.
+
+logger = logging.getLogger(__name__)
+
+# With apidoc_prune, the generated pages are listed in this manifest (see
+# ``manifest``) of the output directory, so the next build knows which
+# orphans it may remove.
+MANIFEST_NAME = '.apidoc-manifest.json'
+
+# config value -> (attribute of the command line options, default)
+OPTIONS = { 'apidoc_respect_all': ('respect_all', False),
+            'apidoc_includeprivate': ('includeprivate', False),
+            'apidoc_separatemodules': ('separatemodules', False),
+            'apidoc_modulefirst': ('modulefirst', False),
+            'apidoc_noheadings': ('noheadings', False),
+            'apidoc_notoc': ('notoc', False),
+            'apidoc_maxdepth': ('maxdepth', 4),
+            'apidoc_followlinks': ('followlinks', False),
+            'apidoc_ignore_errors': ('ignore_errors', False),
+            'apidoc_no_static': ('no_static', False),
+            'apidoc_import_timeout': ('import_timeout', None),
+            'apidoc_import_memory': ('import_memory', None),
+            'apidoc_static_members': ('static_members', False),
+            'apidoc_header': ('header', None),
+            'apidoc_templates_dir': ('templates_dir', None),
+            'apidoc_toc_max_entries': ('toc_max_entries', 0),
+            'apidoc_prune': ('prune', False),
+            'apidoc_suffix': ('suffix', 'rst') }
+
+
+def setup(app):
+    app.add_config_value('apidoc_module_dir', None, 'env')
+    app.add_config_value('apidoc_output_dir', 'api', 'env')
+    app.add_config_value('apidoc_excluded_paths', [], 'env')
+    for name, (_, default) in OPTIONS.items():
+        app.add_config_value(name, default, 'env')
+    app.connect('builder-inited', builder_inited)
+    return { 'parallel_read_safe': True }
+
+
+def builder_inited(app):
+    config = app.config
+    if not config.apidoc_module_dir:
+        logger.warning('apidoc_module_dir is not set, no API pages generated')
+        return
+    srcdir = str(app.srcdir)
+    rootpath = os.path.normpath(os.path.join(srcdir, config.apidoc_module_dir))
+    opts = make_options(config, os.path.join(srcdir, config.apidoc_output_dir))
+    if opts.templates_dir:
+        opts.templates_dir = os.path.join(srcdir, opts.templates_dir)
+    if not os.path.isdir(rootpath) and not walker.is_archive(rootpath):
+        raise ExtensionError('apidoc_module_dir %s is not a directory, a '
+                             'wheel, an egg or a zip file' % rootpath)
+    if opts.includeprivate and opts.respect_all:
+        raise ExtensionError('Either apidoc_includeprivate or '
+                             'apidoc_respect_all but not both')
+    try:
+        opts.templates = templates.Templates(opts.templates_dir)
+    except templates.TemplateError as e:
+        raise ExtensionError(str(e))
+    try:
+        excludes = matcher.Matcher(config.apidoc_excluded_paths, rootpath)
+    except matcher.PatternError as e:
+        raise ExtensionError(str(e))
+    generate_pages(rootpath, excludes, opts)
+
+
+def make_options(config, destdir):
+    opts = hacked.default_options(destdir=destdir, update=True, quiet=True,
+                                  keep_modules=True)
+    for name, (attribute, _) in OPTIONS.items():
+        setattr(opts, attribute, getattr(config, name))
+    if opts.suffix.startswith('.'):
+        opts.suffix = opts.suffix[1:]
+    return opts
+
+
+def generate_pages(rootpath, excludes, opts):
+    """Writes the pages of ``hacked.generate`` that changed (--update)."""
+    if not os.path.isdir(opts.destdir):
+        os.makedirs(opts.destdir)
+    if opts.respect_all or opts.static_members:
+        opts.cache = pkgcache.open_cache(opts)
+    opts.generated = set()
+    hacked.get_stats(opts)  # shared with the copy of hacked.generate
+    previous = None
+    if opts.prune:
+        import plan
+        opts.manifest_file = os.path.join(opts.destdir, MANIFEST_NAME)
+        previous = plan.previous_files(opts.manifest_file)
+        hacked.open_manifest(rootpath, excludes, opts)
+    try:
+        for docname, text in hacked.generate(rootpath, excludes, opts):
+            hacked.write_file(docname, text, opts)
+    except SystemExit:  # import error reported by hacked.report_import_error
+        raise ExtensionError('Could not import a package of %s (set '
+                             'apidoc_ignore_errors or exclude it)' % rootpath)
+    hacked.save_cache(opts)
+    hacked.save_manifest(opts)
+    if opts.prune:
+        hacked.prune_orphans(previous, opts)
+    logger.info('[apidoc] %d page(s) created, %d updated, %d unchanged in %s' %
+                tuple([opts.stats.get(counter) for counter in
+                       ('files_created', 'files_updated', 'files_unchanged')] +
+                      [opts.destdir]))
@@ -0,0 +1,101 @@
+from __future__ import print_function
+import time
+from contextlib import contextmanager
+
+# Run statistics for --stats: wall time per phase, counters, the time spent
+# on each package and the packages whose import went over the budget
+# (--import-timeout, --import-memory).
+
+PHASES = ('walk', 'parse', 'import', 'build', 'write')
+
+
+class Stats(object):
+    """The phases are timed exclusively: entering a phase pauses the one it
+    is nested in, so the phase times add up to the total."""
+
+    def __init__(self):
+        self.start = time.time()
+        self.times = dict((name, 0.0) for name in PHASES)
+        self.counters = {}
+        self.package_times = {}
+        self.over_budget = []  # [(package, reason, seconds)]
+        self.stack = []  # [phase name, time it was (re)started]
+
+    def count(self, counter, n=1):
+        self.counters[counter] = self.counters.get(counter, 0) + n
+
+    def get(self, counter):
+        return self.counters.get(counter, 0)
+
+    @contextmanager
+    def phase(self, name):
+        now = time.time()
+        if self.stack:
+            self.pause(now)
+        self.stack.append([name, now])
+        try:
+            yield
+        finally:
+            self.pause(time.time())
+            self.stack.pop()
+            if self.stack:
+                self.stack[-1][1] = time.time()
+
+    def pause(self, now):
+        name, started = self.stack[-1]
+        self.times[name] = self.times.get(name, 0.0) + now - started
+
+    def add_package_time(self, package, seconds):
+        self.package_times[package] = \
+                               self.package_times.get(package, 0.0) + seconds
+
+    def add_over_budget(self, package, reason, seconds):
+        self.over_budget.append((package, reason, seconds))
+        self.count('packages_over_budget')
+
+    def slowest(self, n):
+        return sorted(self.package_times.items(), key=lambda item: -item[1])[:n]
+
+    def as_dict(self, top=10):
+        return { 'total': round(time.time() - self.start, 6),
+                 'phases': dict((k, round(v, 6))
+                                for k, v in self.times.items()),
+                 'counters': dict(self.counters),
+                 'slowest_packages': [ { 'package': p, 'seconds': round(s, 6) }
+                                       for p, s in self.slowest(top) ],
+                 'over_budget': [ { 'package': p, 'reason': r,
+                                    'seconds': round(s, 6) }
+                                  for p, r, s in self.over_budget ] }
+
+    def report(self, top=10):
+        data = self.as_dict(top)
+        lines = ['Total: %.3f s' % data['total'], 'Phases:']
+        for name in sorted(data['phases'], key=phase_order):
+            lines.append('  %-8s %9.3f s' % (name, data['phases'][name]))
+        lines.append('Counters:')
+        for name in sorted(data['counters']):
+            lines.append('  %-20s %9d' % (name, data['counters'][name]))
+        if data['slowest_packages']:
+            lines.append('Slowest packages:')
+            for entry in data['slowest_packages']:
+                lines.append('  %9.3f s  %s' % (entry['seconds'],
+                                                 entry['package']))
+        if data['over_budget']:
+            lines.append('Over the import budget:')
+            lines.extend(over_budget_lines(self.over_budget))
+        return '\n'.join(lines)
+
+    def save(self, filename, top=10):
+        import json
+        with open(filename, 'w') as f:
+            json.dump(self.as_dict(top), f, indent=1, sort_keys=True)
+            f.write('\n')
+
+
+def over_budget_lines(over_budget):
+    return [ '  %9.3f s  %s (%s)' % (seconds, package, reason)
+             for package, reason, seconds in over_budget ]
+
+
+def phase_order(name):
+    return PHASES.index(name) if name in PHASES else len(PHASES)
@@ -0,0 +1,136 @@
+from __future__ import print_function
+import os
+
+# Page templates. Every piece of a generated page (headings, toctrees and
+# their entries, automodule directives and their options) is a fragment, a
+# %-format string, and the sections of a package page are rendered in the
+# order of a layout. Both can be replaced from a directory (--templates)
+# without touching the code:
+#
+#   <fragment>.txt   replaces the fragment of that name, see FRAGMENTS
+#   package.layout   the sections of a package page, one per line, see
+#                    SECTIONS; leaving one out drops it from the pages
+#
+# The pages are rendered fragment by fragment into a ``write`` callable.
+
+FRAGMENTS = {
+    # %(level)s is 1 for the page title and 2 for the sections
+    'heading':          '%(text)s\n%(underline)s\n\n',
+    'automodule':       '.. automodule:: %(name)s\n',
+    'option':           '    :%(option)s:\n',
+    'option_value':     '    :%(option)s: %(value)s\n',
+    'toctree':          '.. toctree::\n',
+    'toctree_option':   '   :%(option)s: %(value)s\n',
+    'toctree_entry':    '   %(name)s\n',
+    'subpackage_entry': '    %(name)s\n',
+    'blank':            '\n',
+}
+
+HEADING_CHARS = '=-~'
+
+SECTIONS = ('title', 'module_first', 'subpackages', 'submodules',
+            'module_last')
+LAYOUT_NAME = 'package.layout'
+
+# Every field that a fragment may use, to check the fragments when loading
+SAMPLE = dict(text='text', underline='====', level=1, name='name',
+              option='option', value='value')
+
+
+class TemplateError(Exception):
+    pass
+
+
+class Templates(object):
+    """The fragments and the package page layout, the defaults updated with
+    the files in ``directory`` if given."""
+
+    def __init__(self, directory=None):
+        self.fragments = dict(FRAGMENTS)
+        self.layout = SECTIONS
+        if directory:
+            self.load(directory)
+
+    def load(self, directory):
+        try:
+            names = sorted(os.listdir(directory))
+        except OSError as e:
+            raise TemplateError('Cannot read the templates: %s' % e)
+        for fname in names:
+            name, ext = os.path.splitext(fname)
+            path = os.path.join(directory, fname)
+            if fname == LAYOUT_NAME:
+                self.layout = read_layout(path)
+            elif ext == '.txt':
+                self.fragments[name] = read_fragment(path, name)
+
+    def render(self, write, fragment, **values):
+        write(self.fragments[fragment] % values)
+
+    def heading(self, write, level, text):
+        self.render(write, 'heading', text=text, level=level,
+                    underline=HEADING_CHARS[level - 1] * len(text))
+
+    def automodule(self, write, name, options, members=None):
+        """The directive with the flag ``options``; a list of ``members``
+        replaces the bare ``:members:`` option (--static-members)."""
+        self.render(write, 'automodule', name=name)
+        for option in options:
+            if option == 'members' and members is not None:
+                if members:  # an empty :members: would document everything
+                    self.render(write, 'option_value', option=option,
+                                value=', '.join(members))
+                continue
+            self.render(write, 'option', option=option)
+
+    def toctree(self, write, entries, options=(), entry='toctree_entry'):
+        """A toctree with ``(name, value)`` ``options`` listing ``entries``,
+        rendered with the fragment ``entry``."""
+        self.render(write, 'toctree')
+        for option, value in options:
+            self.render(write, 'toctree_option', option=option, value=value)
+        self.render(write, 'blank')
+        self.entries(write, entries, entry)
+
+    def entries(self, write, entries, entry='toctree_entry'):
+        for name in entries:
+            self.render(write, entry, name=name)
+
+    def digest(self):
+        """A hash of the fragments and the layout, to tell whether the pages
+        of another run were rendered with the same templates."""
+        import hashlib
+        text = repr((sorted(self.fragments.items()), list(self.layout)))
+        return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+
+def read_fragment(path, name):
+    if name not in FRAGMENTS:
+        raise TemplateError('Unknown template fragment %s (expected one of '
+                            '%s)' % (path, ', '.join(sorted(FRAGMENTS))))
+    with open(path) as f:
+        fragment = f.read()
+    try:
+        fragment % SAMPLE
+    except (KeyError, ValueError, TypeError) as e:
+        raise TemplateError('Invalid template fragment %s: %r' % (path, e))
+    return fragment
+
+
+def read_layout(path):
+    with open(path) as f:
+        layout = tuple(line.strip() for line in f if line.strip())
+    unknown = [section for section in layout if section not in SECTIONS]
+    if unknown:
+        raise TemplateError('Unknown section(s) %s in %s (expected some of '
+                            '%s)' % (', '.join(unknown), path,
+                                     ', '.join(SECTIONS)))
+    return layout
+
+
+def render(render_page, *args):
+    """Renders a page with ``render_page(write, *args)`` into a string; the
+    fragments are joined once, in linear time."""
+    parts = []
+    render_page(parts.append, *args)
+    return ''.join(parts)
@@ -0,0 +1,288 @@
+from __future__ import print_function
+import os
+import stat
+from os.path import join
+
+# Directory tree walker that reads each directory only once (with scandir)
+# and remembers what it has seen, so that the file sizes and the presence of
+# __init__.py can be looked up later without statting the same path again.
+#
+# Wheels, eggs and zip files are walked like directories without extracting
+# them: the path of a member is the path of the archive joined with the path
+# of the member inside it, e.g. dist/foo-1.0-py3-none-any.whl/foo/__init__.py.
+# The listings come from the central directory of the archive and ``read``
+# reads the members straight from it.
+
+try:
+    from os import scandir
+except ImportError:
+    try:
+        from scandir import scandir  # backport for Python 2
+    except ImportError:
+        scandir = None
+
+INITPY = '__init__.py'
+
+# directory -> (subdirectories, files), both dicts: name -> directory entry
+LISTINGS = {}
+# directory -> bool, for directories that were not listed (yet)
+HAS_INITPY = {}
+ARCHIVE_SUFFIXES = ('.whl', '.egg', '.zip')
+# archive -> {directory inside the archive: (subdirectories, files)}
+ARCHIVES = {}
+# archive -> open zipfile.ZipFile
+ZIPFILES = {}
+
+
+def walk(top, followlinks=False):
+    """A replacement for ``os.walk`` (top-down, ``dirs`` can be modified in
+    place to prune the walk) that yields ``(root, dirs, files)`` where
+    ``dirs`` is a list of names and ``files`` is a dict mapping the file names
+    to their directory entries, see ``listdir``. The ``dirs`` are sorted, as
+    ``sphinx.util.osutil.walk`` does, so the order of the walk does not
+    depend on the file system."""
+    subdirs, files = listdir(top)
+    dirs = sorted(subdirs)
+    yield top, dirs, files
+    for name in dirs:
+        if followlinks or not subdirs[name].is_symlink():
+            for item in walk(join(top, name), followlinks):
+                yield item
+
+
+def listdir(directory):
+    """Reads ``directory`` once and returns two dicts mapping the names of its
+    subdirectories and of its files to ``os.DirEntry`` (or equivalent)
+    objects. Unreadable directories are reported as empty, like ``os.walk``
+    does. The result is cached until ``forget`` is called."""
+    listing = LISTINGS.get(directory)
+    if listing is not None:
+        return listing
+    listing = archive_listing(directory)
+    if listing is not None:
+        LISTINGS[directory] = listing
+        return listing
+    dirs, files = {}, {}
+    try:
+        for entry in scan(directory):
+            try:
+                if entry.is_dir():
+                    dirs[entry.name] = entry
+                else:
+                    files[entry.name] = entry
+            except OSError:  # dangling symlink, for example
+                pass
+    except OSError:
+        pass
+    LISTINGS[directory] = (dirs, files)
+    HAS_INITPY.pop(directory, None)
+    return dirs, files
+
+
+def has_initpy(directory):
+    """Whether ``directory`` contains an ``__init__.py``; uses the listing if
+    the directory was already read and a single stat otherwise."""
+    listing = LISTINGS.get(directory)
+    if listing is None and ARCHIVES:
+        listing = archive_listing(directory)
+    if listing is not None:
+        return INITPY in listing[1]
+    result = HAS_INITPY.get(directory)
+    if result is None:
+        result = os.path.isfile(join(directory, INITPY))
+        HAS_INITPY[directory] = result
+    return result
+
+
+def getsize(filename):
+    """Same as ``os.path.getsize`` but reuses the directory entry (and its
+    cached stat result) if the parent directory was already read."""
+    listing = LISTINGS.get(os.path.dirname(filename))
+    entry = listing and listing[1].get(os.path.basename(filename))
+    if entry is None:
+        return os.path.getsize(filename)
+    return entry.stat().st_size
+
+
+def forget(directory=None):
+    """Drops the cached listings of ``directory`` (of everything if
+    ``None``), for example after it has changed on disk."""
+    if directory is None:
+        LISTINGS.clear()
+        HAS_INITPY.clear()
+        ARCHIVES.clear()
+        for zf in ZIPFILES.values():
+            zf.close()
+        ZIPFILES.clear()
+    else:
+        LISTINGS.pop(directory, None)
+        HAS_INITPY.pop(directory, None)
+
+
+def forget_tree(directory):
+    """Drops the cached listings of ``directory`` and of everything below it
+    (archives included), for example after it was moved or deleted."""
+    prefix = os.path.join(directory, '')
+    for cached in (LISTINGS, HAS_INITPY):
+        for path in list(cached):
+            if path == directory or path.startswith(prefix):
+                del cached[path]
+    for archive in list(ARCHIVES):
+        if archive == directory or archive.startswith(prefix):
+            del ARCHIVES[archive]
+            zf = ZIPFILES.pop(archive, None)
+            if zf is not None:
+                zf.close()
+
+
+def is_archive(path):
+    """Whether ``path`` is a wheel, an egg or a zip file that can be walked
+    like a directory."""
+    if not path.endswith(ARCHIVE_SUFFIXES) or not os.path.isfile(path):
+        return False
+    import zipfile  # only needed for archives
+    return zipfile.is_zipfile(path)
+
+
+def archive_listing(directory):
+    """The listing of ``directory`` if it is an archive or a directory inside
+    one, ``None`` otherwise."""
+    if directory not in ARCHIVES and is_archive(directory):
+        open_archive(directory)
+    for archive, listings in ARCHIVES.items():
+        if directory == archive or directory.startswith(join(archive, '')):
+            return listings.get(directory, ({}, {}))
+    return None
+
+
+def open_archive(archive):
+    """Builds the listings of all the directories of ``archive`` from its
+    central directory, nothing is extracted."""
+    import zipfile
+    zf = zipfile.ZipFile(archive)
+    mtime = os.stat(archive).st_mtime
+    listings = {archive: ({}, {})}
+    for info in zf.infolist():
+        parts = [part for part in info.filename.split('/') if part]
+        if not parts or '..' in parts:
+            continue
+        directory = archive
+        for i, part in enumerate(parts):
+            dirs, files = listings[directory]
+            path = join(directory, part)
+            if i == len(parts) - 1 and not info.filename.endswith('/'):
+                files[part] = ArchiveEntry(part, path, False, info.file_size,
+                                           mtime)
+                break
+            if part not in dirs:
+                dirs[part] = ArchiveEntry(part, path, True, 0, mtime)
+                listings.setdefault(path, ({}, {}))
+            directory = path
+    ARCHIVES[archive] = listings
+    ZIPFILES[archive] = zf
+
+
+def archive_of(path):
+    """The archive that ``path`` is a member of, or ``None``."""
+    for archive in ARCHIVES:
+        if path.startswith(join(archive, '')):
+            return archive
+    if not any(suffix + os.sep in path for suffix in ARCHIVE_SUFFIXES) or \
+       os.path.exists(path):
+        return None
+    parent = os.path.dirname(path)
+    while parent and parent != path:
+        if is_archive(parent):
+            open_archive(parent)
+            return parent
+        path, parent = parent, os.path.dirname(parent)
+    return None
+
+
+def read(filename):
+    """The content of ``filename`` as bytes, read straight from the archive
+    for a member of one."""
+    archive = archive_of(filename)
+    if archive is None:
+        with open(filename, 'rb') as f:
+            return f.read()
+    member = filename[len(archive) + 1:].replace(os.sep, '/')
+    try:
+        return ZIPFILES[archive].read(member)
+    except KeyError:
+        raise IOError('No member %s in %s' % (member, archive))
+
+
+def stat_file(filename):
+    """``os.stat`` that also works for the files of an archive, see
+    ``ArchiveEntry``."""
+    archive = archive_of(filename)
+    if archive is None:
+        return os.stat(filename)
+    directory, name = os.path.split(filename)
+    entry = ARCHIVES[archive].get(directory, ({}, {}))[1].get(name)
+    if entry is None:
+        raise OSError('No member %s in %s' % (filename, archive))
+    return entry.stat()
+
+
+def isfile(filename):
+    try:
+        stat_file(filename)
+    except OSError:
+        return False
+    return archive_of(filename) is not None or os.path.isfile(filename)
+
+
+class ArchiveEntry(object):
+    """The part of ``os.DirEntry`` that we need, for a member of an
+    archive; ``stat`` only gives the size and the mtime of the archive."""
+
+    def __init__(self, name, path, is_dir, size, mtime):
+        self.name = name
+        self.path = path
+        self._is_dir = is_dir
+        self._stat = os.stat_result((0, 0, 0, 0, 0, 0, size, mtime, mtime,
+                                     mtime))
+
+    def stat(self):
+        return self._stat
+
+    def is_dir(self):
+        return self._is_dir
+
+    def is_symlink(self):
+        return False
+
+
+def scan(directory):
+    if scandir is not None:
+        return scandir(directory)
+    return [FallbackEntry(directory, name) for name in os.listdir(directory)]
+
+
+class FallbackEntry(object):
+    """The part of ``os.DirEntry`` that we need, for Python 2 without the
+    scandir backport. Each stat is done at most once."""
+
+    def __init__(self, directory, name):
+        self.name = name
+        self.path = join(directory, name)
+        self._stat = None
+        self._lstat = None
+
+    def stat(self):
+        if self._stat is None:
+            self._stat = os.stat(self.path)
+        return self._stat
+
+    def is_dir(self):
+        try:
+            return stat.S_ISDIR(self.stat().st_mode)
+        except OSError:
+            return False
+
+    def is_symlink(self):
+        if self._lstat is None:
+            self._lstat = os.lstat(self.path)
+        return stat.S_ISLNK(self._lstat.st_mode)
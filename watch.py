@@ -0,0 +1,260 @@
+from __future__ import print_function
+import ctypes
+import ctypes.util
+import errno
+import os
+import select
+import struct
+import sys
+import time
+from os.path import join
+
+import walker
+
+# Watch mode: regenerates the output whenever Python files or packages are
+# added, removed or renamed, or an __init__ file is edited. Uses inotify on
+# Linux and polls the directory mtimes elsewhere.
+
+POLL_INTERVAL = 0.5  # seconds
+SETTLE_TIME = 0.05   # wait this long for more events before regenerating
+PY_SUFFIXES = ('.py', '.pyx')
+INITFILES = ('__init__.py', '__init__.pyx')
+
+
+def watch(rootpath, opts, regenerate):
+    """Calls ``regenerate()`` and calls it again after every relevant change
+    under ``rootpath`` until interrupted. The pages are kept in memory
+    (``opts.last_written``) so that only the changed ones are written, and
+    the pages of packages that are gone are removed."""
+    opts.update = True
+    opts.last_written = {}
+    watcher = make_watcher()
+    wrapped_print('Watching %s for changes (%s), press Ctrl+C to stop.' %
+                  (rootpath, watcher.kind), opts)
+    run_pass(regenerate, opts)
+    try:
+        while True:
+            watcher.sync(watched_directories())
+            events = watcher.read(None)
+            deadline = time.time() + SETTLE_TIME
+            while time.time() < deadline:
+                events += watcher.read(max(deadline - time.time(), 0))
+            events = [e for e in events if is_relevant(e)]
+            if not events:
+                continue
+            start = time.time()
+            invalidate(events, opts)
+            run_pass(regenerate, opts)
+            wrapped_print('Regenerated after %d change(s) in %.3f s.' %
+                          (len(events), time.time() - start), opts)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        watcher.close()
+
+
+def run_pass(regenerate, opts):
+    opts.generated = set()
+    regenerate()
+    for fname in sorted(set(opts.last_written) - opts.generated):
+        wrapped_print('Removing file %s.' % fname, opts)
+        del opts.last_written[fname]
+        if os.path.isfile(fname):
+            os.remove(fname)
+
+
+def watched_directories():
+    # Listed directories (visited by the walk) and the directories whose
+    # __init__.py was looked up: they may turn into packages.
+    return set(walker.LISTINGS) | set(walker.HAS_INITPY)
+
+
+def is_relevant(event):
+    directory, name, is_dir = event
+    return name is None or is_dir or name.endswith(PY_SUFFIXES)
+
+
+def invalidate(events, opts):
+    """Drops everything that the events may have made stale: the directory
+    listings and the cached ``__all__`` lookups."""
+    cache = getattr(opts, 'cache', None)
+    for directory, name, is_dir in events:
+        if directory is None:  # lost track, start over
+            walker.forget()
+            if cache is not None:
+                cache.results.clear()
+            continue
+        walker.forget(directory)
+        path = join(directory, name) if name is not None else directory
+        if is_dir or name is None:
+            walker.forget_tree(path)
+        if cache is not None:
+            cache.forget(path)
+
+
+def make_watcher():
+    try:
+        return InotifyWatcher()
+    except (OSError, AttributeError):
+        return PollingWatcher()
+
+
+class InotifyWatcher(object):
+    """Watches directories with inotify, through ctypes."""
+
+    kind = 'inotify'
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_FROM  = 0x00000040
+    IN_MOVED_TO    = 0x00000080
+    IN_CREATE      = 0x00000100
+    IN_DELETE      = 0x00000200
+    IN_DELETE_SELF = 0x00000400
+    IN_MOVE_SELF   = 0x00000800
+    IN_Q_OVERFLOW  = 0x00004000
+    IN_IGNORED     = 0x00008000
+    IN_ONLYDIR     = 0x01000000
+    IN_ISDIR       = 0x40000000
+    IN_CLOEXEC     = 0o2000000
+    MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | \
+           IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR
+    EVENT = struct.Struct('iIII')
+
+    def __init__(self):
+        if not sys.platform.startswith('linux'):
+            raise OSError('inotify is only available on Linux')
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self.add_watch = libc.inotify_add_watch
+        self.add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p,
+                                   ctypes.c_uint32]
+        self.rm_watch = libc.inotify_rm_watch
+        self.fd = libc.inotify_init1(self.IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        self.paths = {}  # watch descriptor -> directory
+        self.wds = {}    # directory -> watch descriptor
+
+    def sync(self, directories):
+        for directory in directories - set(self.wds):
+            wd = self.add_watch(self.fd, encode(directory), self.MASK)
+            if wd >= 0:
+                self.paths[wd] = directory
+                self.wds[directory] = wd
+            elif ctypes.get_errno() == errno.ENOSPC:
+                print('Too many directories to watch, raise '
+                      '/proc/sys/fs/inotify/max_user_watches', file=sys.stderr)
+        for directory in set(self.wds) - directories:
+            self.rm_watch(self.fd, self.wds.pop(directory))
+
+    def read(self, timeout):
+        """Waits at most ``timeout`` seconds (forever if ``None``) and returns
+        the events as a list of ``(directory, name, is_dir)`` tuples."""
+        if not select.select([self.fd], [], [], timeout)[0]:
+            return []
+        data = os.read(self.fd, 1 << 16)
+        events, offset = [], 0
+        while offset < len(data):
+            wd, mask, _, length = self.EVENT.unpack_from(data, offset)
+            offset += self.EVENT.size
+            name = data[offset:offset + length].rstrip(b'\0')
+            offset += length
+            events.extend(self.to_events(wd, mask, decode(name)))
+        return events
+
+    def to_events(self, wd, mask, name):
+        if mask & self.IN_Q_OVERFLOW:
+            return [(None, None, True)]
+        directory = self.paths.get(wd)
+        if directory is None:
+            return []
+        if mask & self.IN_IGNORED:  # watched directory is gone
+            del self.paths[wd]
+            self.wds.pop(directory, None)
+            return []
+        if mask & (self.IN_DELETE_SELF | self.IN_MOVE_SELF):
+            return [(os.path.dirname(directory), os.path.basename(directory),
+                     True)]
+        return [(directory, name, bool(mask & self.IN_ISDIR))]
+
+    def close(self):
+        os.close(self.fd)
+
+
+class PollingWatcher(object):
+    """Fallback: compares the mtimes of the directories and ``__init__``
+    files every ``POLL_INTERVAL`` seconds."""
+
+    kind = 'polling'
+
+    def __init__(self):
+        self.mtimes = {}
+
+    def sync(self, directories):
+        for directory in set(self.mtimes) - directories:
+            del self.mtimes[directory]
+        for directory in directories - set(self.mtimes):
+            self.mtimes[directory] = self.snapshot(directory)
+
+    def snapshot(self, directory):
+        return [mtime(join(directory, name))
+                for name in ('',) + INITFILES]
+
+    def read(self, timeout):
+        while True:
+            events = self.poll()
+            if events or timeout is not None:
+                return events
+            time.sleep(POLL_INTERVAL)
+
+    def poll(self):
+        events = []
+        for directory, before in self.mtimes.items():
+            after = self.snapshot(directory)
+            if after == before:
+                continue
+            self.mtimes[directory] = after
+            if after[0] != before[0]:
+                events.extend(listing_changes(directory))
+            for name, old, new in zip(INITFILES, before[1:], after[1:]):
+                if old != new:
+                    events.append((directory, name, False))
+        return events
+
+    def close(self):
+        pass
+
+
+def listing_changes(directory):
+    """The names added to or removed from ``directory`` since the walker has
+    listed it."""
+    if directory not in walker.LISTINGS:
+        return [(directory, None, True)]
+    old_dirs, old_files = walker.LISTINGS[directory]
+    walker.forget(directory)
+    new_dirs, new_files = walker.listdir(directory)
+    events = [(directory, name, True)
+              for name in set(old_dirs) ^ set(new_dirs)]
+    events += [(directory, name, False)
+               for name in set(old_files) ^ set(new_files)]
+    return events
+
+
+def mtime(path):
+    try:
+        return os.stat(path).st_mtime
+    except OSError:
+        return None
+
+
+def encode(path):
+    return path if isinstance(path, bytes) else \
+           path.encode(sys.getfilesystemencoding())
+
+
+def decode(name):
+    return name if isinstance(name, str) else \
+           name.decode(sys.getfilesystemencoding())
+
+
+def wrapped_print(msg, opts):
+    if not opts.quiet:
+        print(msg)
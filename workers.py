@@ -0,0 +1,145 @@
+from __future__ import print_function
+import multiprocessing
+import multiprocessing.connection
+import os
+import signal
+import time
+import traceback as tb
+
+# Runs functions (the imports of --respect-all) in child processes, each call
+# in a fresh process so that nothing it imports leaks into the parent or into
+# the other calls, and a crash (e.g. a segfault in a C extension) only costs
+# that one call. A call can be given a budget: it is killed if it runs longer
+# than ``timeout`` seconds, and it cannot allocate more than ``memory`` MB
+# (where the address space can be limited, e.g. on Linux).
+
+POLL_INTERVAL = 0.01
+
+
+def run(target, tasks, jobs, timeout=None, memory=None, slots=None):
+    """Calls ``target(*args)`` for each ``(key, args)`` in ``tasks``, at most
+    ``jobs`` processes at a time. Returns a dict mapping each key to either
+    ``('ok', return value)`` or ``('error', message)``; exceptions and crashed
+    processes both become errors. The return value must be picklable. The
+    calls that go over the budget (``timeout``, ``memory``) are aborted, they
+    become ``('budget', (reason, seconds it ran))``. ``slots`` is a
+    semaphore shared by concurrent calls (--batch) that every process holds
+    while it runs."""
+    outcomes = {}
+    pending = list(reversed(tasks))
+    running = []
+    while pending or running:
+        while pending and len(running) < jobs:
+            if slots is not None and not slots.acquire(not running):
+                break  # the other calls use all the slots for now
+            key, args = pending.pop()
+            running.append(start(key, target, args, memory))
+        wait_any(running, timeout)
+        still_running = []
+        for child in running:
+            outcome = collect(child) or over_time(child, timeout)
+            if outcome is None:
+                still_running.append(child)
+            else:
+                outcomes[child[0]] = outcome
+                if slots is not None:
+                    slots.release()
+        running = still_running
+    return outcomes
+
+
+def start(key, target, args, memory=None):
+    reader, writer = multiprocessing.Pipe(duplex=False)
+    proc = multiprocessing.Process(target=call_and_send,
+                                   args=(writer, target, args, memory))
+    proc.daemon = True
+    proc.start()
+    writer.close()  # the child has its own copy
+    return key, proc, reader, time.time()
+
+
+def call_and_send(conn, target, args, memory=None):
+    try:
+        if memory:
+            limit_memory(memory)
+        outcome = ('ok', target(*args))
+    except BaseException as e:  # SystemExit and KeyboardInterrupt too
+        if memory and isinstance(e, MemoryError):
+            outcome = ('budget', 'over the memory budget of %d MB' % memory)
+        else:
+            outcome = ('error', tb.format_exc().rstrip())
+    conn.send(outcome)
+    conn.close()
+
+
+def limit_memory(megabytes):
+    """Lets this process allocate ``megabytes`` more than it uses now, if
+    the address space can be limited here."""
+    try:
+        import resource
+        with open('/proc/self/statm') as f:
+            used = int(f.read().split()[0]) * resource.getpagesize()
+    except (ImportError, IOError, OSError, ValueError):
+        return
+    hard = resource.getrlimit(resource.RLIMIT_AS)[1]
+    limit = used + megabytes * 1024 * 1024
+    if hard != resource.RLIM_INFINITY:
+        limit = min(limit, hard)
+    resource.setrlimit(resource.RLIMIT_AS, (limit, hard))
+
+
+def over_time(child, timeout):
+    """Kills the child and returns its outcome if it ran out of time,
+    ``None`` otherwise."""
+    key, proc, conn, started = child
+    elapsed = time.time() - started
+    if not timeout or elapsed < timeout:
+        return None
+    proc.terminate()
+    proc.join(1)
+    if proc.is_alive() and hasattr(signal, 'SIGKILL'):  # SIGTERM was caught
+        os.kill(proc.pid, signal.SIGKILL)
+        proc.join()
+    conn.close()
+    return ('budget', ('timed out after %.1f s' % timeout, elapsed))
+
+
+def collect(child):
+    """Returns the outcome if the child is done, ``None`` otherwise."""
+    key, proc, conn, started = child
+    if not conn.poll():
+        if proc.is_alive():
+            return None
+        proc.join()
+        if not conn.poll():
+            return crashed(proc)
+    try:
+        outcome = conn.recv()
+    except EOFError:
+        outcome = crashed(proc)
+    conn.close()
+    proc.join()
+    if outcome[0] == 'budget':
+        outcome = ('budget', (outcome[1], time.time() - started))
+    return outcome
+
+
+def crashed(proc):
+    return ('error', 'The importing process died unexpectedly '
+                     '(exit code %s).' % proc.exitcode)
+
+
+def wait_any(running, timeout=None):
+    """Waits until a child is done or, with a ``timeout``, until the first
+    one runs out of time."""
+    wait = getattr(multiprocessing.connection, 'wait', None)
+    if wait is None:  # Python 2
+        time.sleep(POLL_INTERVAL)
+        return
+    waitables = [conn for _, _, conn, _ in running]
+    waitables += [proc.sentinel for _, proc, _, _ in running]
+    remaining = None
+    if timeout:
+        first = min(started for _, _, _, started in running)
+        remaining = max(first + timeout - time.time(), 0)
+    wait(waitables, remaining)
@@ -0,0 +1,244 @@
+from __future__ import print_function
+import io
+import os
+import threading
+import time
+
+try:
+    import queue
+except ImportError:  # Python 2
+    import Queue as queue
+
+# Output stage: writes the generated files atomically (temporary file and
+# rename, so that an interrupted run never leaves a half-written file behind)
+# on a bounded pool of threads, as writing thousands of small files is
+# latency bound on network file systems.
+#
+# Or, with --archive, into a single tar or zip archive (a file or stdout)
+# that is deterministic: the members are sorted by name and all have the
+# same timestamp (SOURCE_DATE_EPOCH if set), owner and mode, so the same
+# pages always give the same bytes.
+
+BATCH_SIZE = 100  # results are logged in batches of this size
+ARCHIVE_FORMATS = (('.tar.gz', 'tar.gz'), ('.tgz', 'tar.gz'), ('.tar', 'tar'),
+                   ('.zip', 'zip'))
+DEFAULT_MTIME = 315532800  # 1980-01-01, the earliest date of a zip member
+
+
+def write(fname, text, force=False, update=False):
+    """Writes <text> to <fname> as dictated by the --force and --update options
+    and returns a ``(message, counter, bytes written)`` tuple describing what
+    happened."""
+    exists = os.path.isfile(fname)
+    if exists and update:
+        if has_content(fname, text):
+            return ('File %s is up to date, skipping.' % fname,
+                    'files_unchanged', 0)
+        message, counter = 'Updating file %s.' % fname, 'files_updated'
+    elif exists and not force:
+        return 'File %s already exists, skipping.' % fname, 'files_skipped', 0
+    elif exists:
+        message, counter = 'Creating file %s.' % fname, 'files_updated'
+    else:
+        message, counter = 'Creating file %s.' % fname, 'files_created'
+    return message, counter, write_atomic(fname, text)
+
+
+def has_content(fname, text):
+    """Whether the file <fname> already contains exactly <text>."""
+    f = open(fname)
+    try:
+        return f.read() == text
+    finally:
+        f.close()
+
+
+def write_atomic(fname, text):
+    """Returns the number of bytes written."""
+    tmp = '%s.%d-%d.tmp' % (fname, os.getpid(), thread_id())
+    fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o666)
+    try:
+        f = os.fdopen(fd, 'w')
+        try:
+            f.write(text)
+        finally:
+            f.close()
+        replace(tmp, fname)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+    return os.path.getsize(fname)
+
+
+def replace(src, dst):
+    if hasattr(os, 'replace'):
+        os.replace(src, dst)
+    else:  # Python 2: rename cannot overwrite on Windows
+        if os.name == 'nt' and os.path.exists(dst):
+            os.remove(dst)
+        os.rename(src, dst)
+
+
+def thread_id():
+    return threading.current_thread().ident
+
+
+class Writer(object):
+    """Writes files on ``threads`` threads with at most ``2 * threads`` files
+    waiting in the queue. ``submit`` and ``close`` return the results (see
+    ``write``) that are ready, in submission order and in batches; an
+    exception raised while writing is re-raised from them."""
+
+    def __init__(self, threads):
+        self.queue = queue.Queue(maxsize=2 * threads)
+        self.results = {}  # index -> result or exception
+        self.lock = threading.Lock()
+        self.submitted = 0
+        self.reported = 0
+        self.threads = [threading.Thread(target=self.work)
+                        for _ in range(threads)]
+        for thread in self.threads:
+            thread.daemon = True
+            thread.start()
+
+    def submit(self, fname, text, force=False, update=False):
+        self.queue.put((self.submitted, fname, text, force, update))
+        self.submitted += 1
+        if len(self.results) >= BATCH_SIZE:
+            return self.ready()
+        return []
+
+    def close(self):
+        for _ in self.threads:
+            self.queue.put(None)
+        for thread in self.threads:
+            thread.join()
+        return self.ready()
+
+    def work(self):
+        while True:
+            task = self.queue.get()
+            if task is None:
+                return
+            index, args = task[0], task[1:]
+            try:
+                result = write(*args)
+            except Exception as e:
+                result = e
+            with self.lock:
+                self.results[index] = result
+
+    def ready(self):
+        batch = []
+        with self.lock:
+            while self.reported in self.results:
+                result = self.results.pop(self.reported)
+                if isinstance(result, Exception):
+                    raise result
+                batch.append(result)
+                self.reported += 1
+        return batch
+
+
+class ArchiveWriter(object):
+    """Same interface as ``Writer``, but collects the files and writes them
+    into the archive ``target`` (a file name, or ``stream``) on ``close``;
+    the member names are relative to the directory ``base``."""
+
+    def __init__(self, target, archive_format, base='', stream=None):
+        self.target = target
+        self.format = archive_format
+        self.base = base or os.curdir
+        self.stream = stream
+        self.members = {}
+
+    def submit(self, fname, text, force=False, update=False):
+        name = os.path.relpath(fname, self.base).replace(os.sep, '/')
+        if not isinstance(text, bytes):
+            text = text.encode('utf-8')
+        self.members[name] = text
+        return []
+
+    def close(self):
+        members = sorted(self.members.items())
+        if self.stream is not None:
+            write_archive(self.stream, members, self.format, archive_mtime())
+            self.stream.flush()
+        else:
+            tmp = '%s.%d.tmp' % (self.target, os.getpid())
+            try:
+                with open(tmp, 'wb') as f:
+                    write_archive(f, members, self.format, archive_mtime())
+                replace(tmp, self.target)
+            except BaseException:
+                if os.path.exists(tmp):
+                    os.remove(tmp)
+                raise
+        return [ ('Adding file %s to %s.' % (name, self.target),
+                  'files_archived', len(data)) for name, data in members ]
+
+
+def archive_format(filename):
+    """The format of the archive file ``filename`` by its suffix, or
+    ``None``."""
+    for suffix, name in ARCHIVE_FORMATS:
+        if filename.endswith(suffix):
+            return name
+    return None
+
+
+def archive_mtime():
+    try:
+        return int(os.environ.get('SOURCE_DATE_EPOCH', DEFAULT_MTIME))
+    except ValueError:
+        return DEFAULT_MTIME
+
+
+def write_archive(f, members, archive_format, mtime):
+    """Writes the sorted ``(name, bytes)`` ``members`` into ``f`` (which
+    does not need to be seekable) as a 'tar', 'tar.gz' or 'zip' archive."""
+    if archive_format == 'zip':
+        write_zip(f, members, mtime)
+    else:
+        write_tar(f, members, mtime, archive_format == 'tar.gz')
+
+
+def write_tar(f, members, mtime, compress=False):
+    import tarfile
+    gz = None
+    if compress:  # not 'w|gz', it would put the current time in the header
+        import gzip
+        f = gz = gzip.GzipFile(filename='', mode='wb', fileobj=f, mtime=mtime)
+    tar = tarfile.open(fileobj=f, mode='w|', format=tarfile.GNU_FORMAT)
+    for name, data in members:
+        info = tarfile.TarInfo(name)
+        info.size = len(data)
+        info.mtime = mtime
+        info.mode = 0o644
+        info.uid = info.gid = 0
+        info.uname = info.gname = ''
+        tar.addfile(info, io.BytesIO(data))
+    tar.close()
+    if gz is not None:
+        gz.close()
+
+
+def write_zip(f, members, mtime):
+    import zipfile
+    try:
+        f.tell()
+    except (AttributeError, IOError, OSError):  # a pipe, e.g. stdout
+        buf = io.BytesIO()
+        write_zip(buf, members, mtime)
+        f.write(buf.getvalue())
+        return
+    date_time = time.gmtime(max(mtime, DEFAULT_MTIME))[:6]
+    zf = zipfile.ZipFile(f, 'w', zipfile.ZIP_DEFLATED)
+    for name, data in members:
+        info = zipfile.ZipInfo(name, date_time)
+        info.compress_type = zipfile.ZIP_DEFLATED
+        info.create_system = 3  # Unix, whatever the platform
+        info.external_attr = 0o644 << 16
+        zf.writestr(info, data)
+    zf.close()